@@ -1,29 +1,153 @@
+"""Add a description to the columns of data dictionaries that lack one.
+
+Accepts several data dictionaries, or directories containing them
+(``participants.json`` or ``*/participants.json``), processed in a single run.
+Files that are not data dictionaries are skipped.
+
+By default, data dictionaries are patched in place
+and only rewritten if a description was added.
+With ``--output``, the data dictionaries are left untouched
+and the patched version is written to:
+- the file passed (or to stdout if it is "-")
+  when a single data dictionary file is passed,
+- ``{output}/{parent directory}/{name}`` when several paths or a directory
+  are passed, for example ``{output}/ds000001/participants.json``.
+"""
+
 import json
+import sys
 from pathlib import Path
 import logging
 
 import typer
 
-
 logger = logging.getLogger(__name__)
 
+DESCRIPTION = "added description for Neurobagel"
 
-def main(in_json: Path):
-    """Add a description to a data dictionary."""
-    with open(in_json, "r") as f:
-        data_dict = json.load(f)
+STREAM = Path("-")
+
+
+def is_data_dictionary(data_dict) -> bool:
+    """Return True if each column of a data dictionary is described by a dict."""
+    return isinstance(data_dict, dict) and all(
+        isinstance(v, dict) for v in data_dict.values()
+    )
 
+
+def add_description(data_dict: dict) -> tuple[dict, bool]:
+    """Return a copy of a data dictionary where all columns have a description.
+
+    Also returns whether any description was added.
+    """
+    data_dict = dict(data_dict)
     have_written = False
     for k, v in data_dict.items():
         if "Description" not in v:
-            data_dict[k]["Description"] = "added description for Neurobagel"
+            data_dict[k] = {**v, "Description": DESCRIPTION}
             have_written = True
+    return data_dict, have_written
+
+
+def list_dictionaries(paths: list[Path]) -> list[Path]:
+    """Expand the directories passed into the data dictionaries they contain.
+
+    Only the participants.json files of a directory and of its subdirectories
+    are listed, not the other JSON files of a BIDS dataset
+    (dataset_description.json, sidecars...).
+    """
+    dictionaries = []
+    for pth in paths:
+        if pth.is_dir():
+            dictionaries.extend(
+                sorted(
+                    [
+                        *pth.glob("participants.json"),
+                        *pth.glob("*/participants.json"),
+                    ]
+                )
+            )
+        else:
+            dictionaries.append(pth)
+    return dictionaries
+
+
+def patch_dictionary(in_json: Path, output: Path | None = None) -> bool:
+    """Add missing descriptions to a data dictionary.
+
+    The patched data dictionary is written to ``output`` if passed
+    (stdout if it is "-"), otherwise ``in_json`` is overwritten
+    only if a description was added.
+
+    Returns whether any description was added.
+    Raises ValueError if the file is not a data dictionary.
+    """
+    if in_json == STREAM:
+        data_dict = json.load(sys.stdin)
+    else:
+        with open(in_json, "r") as f:
+            data_dict = json.load(f)
+
+    if not is_data_dictionary(data_dict):
+        raise ValueError(f"{in_json} is not a data dictionary")
+
+    data_dict, have_written = add_description(data_dict)
+
+    if output is None:
+        if in_json == STREAM:
+            output = STREAM
+        elif have_written:
+            output = in_json
+
+    if output == STREAM:
+        json.dump(data_dict, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    elif output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(data_dict, f, indent=2)
+
+    return have_written
+
+
+def main(
+    in_json: list[Path] = typer.Argument(
+        ...,
+        help="Data dictionaries or directories containing them "
+        '("-" to read a data dictionary from stdin)',
+    ),
+    output: Path = typer.Option(
+        None,
+        help="Write the patched data dictionary to this file "
+        '("-" for stdout) or directory (for several data dictionaries) '
+        "instead of patching the data dictionaries in place",
+    ),
+):
+    """Add a description to a data dictionary."""
+    dictionaries = list_dictionaries(in_json)
+
+    # --output is a directory as soon as several data dictionaries
+    # can be listed, even if only one was found
+    output_is_dir = len(in_json) > 1 or any(pth.is_dir() for pth in in_json)
+    if output_is_dir and output == STREAM:
+        raise typer.BadParameter(
+            "cannot write several data dictionaries to stdout",
+            param_hint="--output",
+        )
+
+    for dictionary in dictionaries:
+        this_output = output
+        if output is not None and output_is_dir:
+            this_output = output / dictionary.parent.name / dictionary.name
 
-    logger.warning(f"Have written: {have_written}")
+        try:
+            have_written = patch_dictionary(dictionary, this_output)
+        except ValueError as exc:
+            logger.warning(f"{exc}: skipping")
+            continue
 
-    with open(in_json, "w") as f:
-        json.dump(data_dict, f, indent=2)
+        logger.warning(f"{dictionary}: Have written: {have_written}")
 
 
 if __name__ == "__main__":
-    typer.run(main)
\ No newline at end of file
+    typer.run(main)
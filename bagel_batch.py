@@ -0,0 +1,324 @@
+"""Run the bagel CLI on the OpenNeuro-JSONLD datasets in one process.
+
+Batch version of parallel_bagel.sh + run_bagel_cli.sh.
+
+For each dataset in inputs/openneuro-jsonld
+that does not have an outputs/openneuro-jsonld/{dataset}.jsonld yet:
+- its name is read from its dataset_description.json,
+- the columns of its participants.json that lack a description get one:
+  the patched data dictionary is saved in outputs/openneuro-jsonld/work/{dataset}
+  so that the dataset itself is never modified,
+- `bagel pheno` then `bagel bids` are run.
+
+The bagel CLI is run in this interpreter if it is installed,
+otherwise in a single long-lived docker container
+in which each command is started with `docker exec`.
+
+Datasets are processed N_JOBS at a time:
+in worker processes with the in-process CLI (CPU-bound and not thread-safe),
+in threads with docker (they only wait for `docker exec`).
+"""
+
+import json
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path, PurePosixPath
+
+import typer
+
+from add_description import add_description
+from extract_bids_dataset_name import get_dataset_name
+from logger import bulk_annotation_logger
+
+LOG_LEVEL = "INFO"
+
+INPUT_DIR = Path("inputs") / "openneuro-jsonld"
+OUTPUT_DIR = Path("outputs") / "openneuro-jsonld"
+
+BAGEL_IMAGE = "neurobagel/bagelcli:latest"
+
+# where the current directory is mounted in the bagel container
+CONTAINER_ROOT = "/data"
+
+PORTAL = "https://github.com/OpenNeuroDatasets-JSONLD/{dataset}.git"
+
+# number of datasets processed at the same time
+N_JOBS = 8
+
+log = bulk_annotation_logger(LOG_LEVEL)
+
+# runner of each worker process of run_batch
+_worker = {"runner": None}
+
+
+class InProcessBagel:
+    """Run bagel CLI commands in the current interpreter.
+
+    ``app`` defaults to the bagel CLI (ImportError if it is not installed).
+    """
+
+    def __init__(self, app=None):
+        # app passed to the runners of the worker processes:
+        # None so that each worker imports the bagel CLI itself
+        self.worker_app = app
+        if app is None:
+            from bagel.cli import bagel as app
+
+        self.app = app
+
+    def __enter__(self) -> "InProcessBagel":
+        """Return the runner (nothing to start)."""
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Do nothing (nothing to stop)."""
+
+    def run(self, args: list[str | Path]) -> None:
+        """Run a bagel command.
+
+        Raises RuntimeError if the command exits with a non-zero code.
+        """
+        # without standalone mode, the exit code of a command
+        # that raises typer.Exit is returned instead of raised
+        exit_code = self.app([str(x) for x in args], standalone_mode=False)
+        if isinstance(exit_code, int) and exit_code != 0:
+            raise RuntimeError(
+                f"bagel {args[0]} failed with exit code {exit_code}"
+            )
+
+
+class DockerBagel:
+    """Run bagel CLI commands in a long-lived docker container.
+
+    The current directory is mounted in the container:
+    all the paths passed to the commands must be in it.
+    """
+
+    def __init__(self, image: str = BAGEL_IMAGE, root: Path | None = None):
+        self.image = image
+        self.root = (root or Path.cwd()).absolute()
+        self.container = None
+
+    def __enter__(self) -> "DockerBagel":
+        """Start the container the commands are run in."""
+        self.container = subprocess.run(
+            [
+                "docker",
+                "run",
+                "--rm",
+                "--detach",
+                "--entrypoint",
+                "sleep",
+                "--volume",
+                f"{self.root}:{CONTAINER_ROOT}",
+                self.image,
+                "infinity",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Stop the container."""
+        subprocess.run(
+            ["docker", "stop", "--time", "0", self.container],
+            capture_output=True,
+        )
+
+    def container_path(self, pth: Path) -> str:
+        """Return the path of a file of the current directory \
+        in the container."""
+        relative_pth = pth.absolute().relative_to(self.root)
+        return str(PurePosixPath(CONTAINER_ROOT, *relative_pth.parts))
+
+    def run(self, args: list[str | Path]) -> None:
+        """Run a bagel command in the container.
+
+        Raises RuntimeError if the command exits with a non-zero code.
+        """
+        args = [
+            self.container_path(x) if isinstance(x, Path) else x for x in args
+        ]
+        result = subprocess.run(
+            ["docker", "exec", self.container, "bagel", *args],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"bagel {args[0]} failed:\n{result.stderr}")
+
+
+def get_runner(image: str = BAGEL_IMAGE) -> InProcessBagel | DockerBagel:
+    """Return an in-process runner if the bagel CLI is installed, \
+    a docker runner otherwise."""
+    try:
+        return InProcessBagel()
+    except ImportError:
+        return DockerBagel(image)
+
+
+def output_file(dataset_pth: Path, output_dir: Path) -> Path:
+    return output_dir / f"{dataset_pth.name}.jsonld"
+
+
+def list_pending(dataset_pths: list[Path], output_dir: Path) -> list[Path]:
+    """Return the datasets that do not have an output file yet."""
+    return [
+        pth
+        for pth in dataset_pths
+        if not output_file(pth, output_dir).exists()
+    ]
+
+
+def prepare_dataset(dataset_pth: Path, work_dir: Path) -> tuple[str, Path]:
+    """Return the name of a dataset and the data dictionary to pass to bagel.
+
+    If descriptions had to be added to the participants.json,
+    the patched data dictionary is saved in the work directory.
+    """
+    name = get_dataset_name(dataset_pth) or dataset_pth.name
+
+    dictionary = dataset_pth / "participants.json"
+    with open(dictionary) as f:
+        data_dict, have_written = add_description(json.load(f))
+
+    if have_written:
+        dictionary = work_dir / "participants.json"
+        with open(dictionary, "w") as f:
+            json.dump(data_dict, f, indent=2)
+
+    return name, dictionary
+
+
+def run_dataset(dataset_pth: Path, runner, output_dir: Path) -> bool:
+    """Run the bagel CLI on one dataset.
+
+    Returns False if any step failed.
+    """
+    work_dir = output_dir / "work" / dataset_pth.name
+    work_dir.mkdir(parents=True, exist_ok=True)
+    pheno = work_dir / "pheno.jsonld"
+    pheno_bids = work_dir / "pheno_bids.jsonld"
+    for pth in [pheno, pheno_bids]:
+        pth.unlink(missing_ok=True)
+
+    try:
+        name, dictionary = prepare_dataset(dataset_pth, work_dir)
+        log.info("dataset '%s': '%s'", dataset_pth.name, name)
+        runner.run(
+            [
+                "pheno",
+                "--pheno",
+                dataset_pth / "participants.tsv",
+                "--dictionary",
+                dictionary,
+                "--output",
+                pheno,
+                "--name",
+                name,
+                "--portal",
+                PORTAL.format(dataset=dataset_pth.name),
+            ]
+        )
+        runner.run(
+            [
+                "bids",
+                "--jsonld-path",
+                pheno,
+                "--bids-dir",
+                dataset_pth,
+                "--output",
+                pheno_bids,
+            ]
+        )
+
+        out = output_file(dataset_pth, output_dir)
+        tmp_file = out.with_suffix(".tmp")
+        shutil.copyfile(pheno_bids, tmp_file)
+        tmp_file.replace(out)
+    except Exception as exc:
+        log.error("dataset '%s' failed: %s", dataset_pth.name, exc)
+        return False
+
+    return True
+
+
+def _init_worker(app=None) -> None:
+    """Create the in-process runner of a worker process."""
+    _worker["runner"] = InProcessBagel(app)
+
+
+def _run_in_worker(dataset_pth: Path, output_dir: Path) -> bool:
+    return run_dataset(dataset_pth, _worker["runner"], output_dir)
+
+
+def run_batch(
+    dataset_pths: list[Path], runner, output_dir: Path, n_jobs: int = 1
+) -> list[str]:
+    """Run the bagel CLI on several datasets.
+
+    With an InProcessBagel runner and ``n_jobs > 1``, datasets are processed
+    in ``n_jobs`` processes, each with its own runner.
+    Otherwise they are processed in ``n_jobs`` threads sharing ``runner``.
+
+    Returns the names of the datasets that failed.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if isinstance(runner, InProcessBagel) and n_jobs > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_worker,
+            initargs=(runner.worker_app,),
+        )
+        run = partial(_run_in_worker, output_dir=output_dir)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max(n_jobs, 1))
+        run = partial(run_dataset, runner=runner, output_dir=output_dir)
+
+    with executor:
+        succeeded = list(executor.map(run, dataset_pths))
+    return [
+        pth.name
+        for pth, success in zip(dataset_pths, succeeded)
+        if not success
+    ]
+
+
+def main(
+    datasets: list[Path] = typer.Argument(
+        None,
+        help=f"Datasets to process (default: all the datasets in {INPUT_DIR})",
+    ),
+    output_dir: Path = typer.Option(OUTPUT_DIR, help="Output directory"),
+    n_jobs: int = typer.Option(N_JOBS, help="Number of datasets in parallel"),
+    image: str = typer.Option(
+        BAGEL_IMAGE, help="bagel CLI image if it is not installed"
+    ),
+):
+    """Run the bagel CLI on datasets that were not processed yet."""
+    if not datasets:
+        datasets = sorted(pth for pth in INPUT_DIR.iterdir() if pth.is_dir())
+
+    pending = list_pending(datasets, output_dir)
+    log.info(
+        "%d datasets to process (%d already done)",
+        len(pending),
+        len(datasets) - len(pending),
+    )
+    if not pending:
+        return
+
+    with get_runner(image) as runner:
+        failed = run_batch(pending, runner, output_dir, n_jobs)
+
+    if failed:
+        log.error("%d datasets failed: %s", len(failed), failed)
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,364 @@
+"""Benchmark the annotation pipeline on a synthetic corpus.
+
+A corpus is generated with synthetic_corpus.py in a temporary directory,
+then each benchmark is timed REPEATS times.
+
+Results are saved as JSON in outputs/benchmarks/
+(named after the date and the current git commit)
+so that they can be compared between commits:
+
+    python benchmark.py --compare outputs/benchmarks/<previous results>.json
+
+Benchmarks:
+- list_openneuro: indexing of the datasets (describe_raw_dataset,
+  without the datalad install)
+- read_csv_autodetect_date: reading of all the participants.tsv
+- get_column_type: type detection of all the columns
+- list_levels: listing of the levels of all the columns
+- scan_participants: scan of all the datasets (columns and levels outputs)
+- sanity_checks: checks of the levels output
+- process_dict: data dictionaries built from synthetic annotations
+
+The import time of the scripts launched once per dataset
+(see parallel_bagel.sh) is also measured with ``python -X importtime``
+and checked against STARTUP_BUDGETS.
+"""
+
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import typer
+
+from heuristics import get_column_type
+from list_openneuro_dependencies import describe_raw_dataset, map_datasets
+from process_annotation_to_dict import process_dict
+from scan_participants import list_levels, sanity_checks, scan_dataset
+from synthetic_corpus import annotate_levels, generate_corpus
+from utils import (
+    LEVELS_DTYPES,
+    get_participants_dict,
+    init_output,
+    new_row_template,
+    output_dir,
+    read_csv_autodetect_date,
+    read_table,
+    write_table,
+)
+
+# number of times each benchmark is run
+REPEATS = 3
+
+# maximum import time (in seconds) of the scripts launched once per dataset
+STARTUP_BUDGETS = {
+    "add_description": 0.15,
+    "extract_bids_dataset_name": 0.15,
+    "bagel_batch": 0.3,
+}
+
+# benchmark name -> function returning the number of items processed
+BENCHMARKS: dict[str, Callable[[dict], int]] = {}
+
+
+def benchmark(func: Callable[[dict], int]) -> Callable[[dict], int]:
+    """Register a benchmark.
+
+    The function is passed the context returned by prepare_context.
+    """
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+def prepare_context(openneuro: Path, work_dir: Path) -> dict:
+    """Return the inputs of the benchmarks computed from a corpus."""
+    dataset_pths = sorted(openneuro.glob("ds*"))
+    datasets = [
+        pd.Series(describe_raw_dataset(pth), name=pth.name)
+        for pth in dataset_pths
+    ]
+    participants = [
+        read_csv_autodetect_date(pth / "participants.tsv", sep="\t")
+        for pth in dataset_pths
+    ]
+    participants_dicts = [
+        get_participants_dict(dataset, openneuro) for dataset in datasets
+    ]
+
+    levels = init_output(include_levels=True)
+    for dataset in datasets:
+        dataset_levels = scan_dataset(dataset, openneuro)["levels"]
+        for key in levels:
+            levels[key].extend(dataset_levels[key])
+    levels_file = work_dir / "bulk_annotation_levels.tsv"
+    write_table(pd.DataFrame.from_dict(levels), levels_file)
+
+    annotated = annotate_levels(read_table(levels_file, LEVELS_DTYPES))
+
+    return {
+        "openneuro": openneuro,
+        "dataset_pths": dataset_pths,
+        "datasets": datasets,
+        "participants": participants,
+        "participants_dicts": participants_dicts,
+        "levels_file": levels_file,
+        "annotated": annotated,
+    }
+
+
+@benchmark
+def bench_list_openneuro(context: dict) -> int:
+    list(map_datasets(describe_raw_dataset, context["dataset_pths"]))
+    return len(context["dataset_pths"])
+
+
+@benchmark
+def bench_read_csv_autodetect_date(context: dict) -> int:
+    for pth in context["dataset_pths"]:
+        read_csv_autodetect_date(pth / "participants.tsv", sep="\t")
+    return len(context["dataset_pths"])
+
+
+@benchmark
+def bench_get_column_type(context: dict) -> int:
+    nb_columns = 0
+    for participants in context["participants"]:
+        for column in participants.columns:
+            get_column_type(participants[column])
+            nb_columns += 1
+    return nb_columns
+
+
+@benchmark
+def bench_list_levels(context: dict) -> int:
+    nb_columns = 0
+    for dataset, participants, participants_dict in zip(
+        context["datasets"],
+        context["participants"],
+        context["participants_dicts"],
+    ):
+        row_template = new_row_template(
+            dataset["name"], nb_rows=len(participants), include_levels=True
+        )
+        output = init_output(include_levels=True)
+        for column in participants.columns:
+            list_levels(
+                output, participants, participants_dict, column, row_template
+            )
+            nb_columns += 1
+    return nb_columns
+
+
+@benchmark
+def bench_scan_participants(context: dict) -> int:
+    for dataset in context["datasets"]:
+        scan_dataset(dataset, context["openneuro"])
+    return len(context["datasets"])
+
+
+@benchmark
+def bench_sanity_checks(context: dict) -> int:
+    sanity_checks(context["levels_file"])
+    return len(context["datasets"])
+
+
+@benchmark
+def bench_process_dict(context: dict) -> int:
+    nb_datasets = 0
+    for _, ds_df in context["annotated"].groupby("dataset", observed=True):
+        process_dict(ds_df, {})
+        nb_datasets += 1
+    return nb_datasets
+
+
+def run_benchmark(
+    func: Callable[[dict], int], context: dict, repeats: int = REPEATS
+) -> dict:
+    """Time a benchmark.
+
+    Returns the duration of each run (in seconds), their summary
+    and the number of items processed per second in the fastest run.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        nb_items = func(context)
+        times.append(time.perf_counter() - start)
+    return {
+        "times": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "nb_items": nb_items,
+        "items_per_s": nb_items / min(times) if min(times) else None,
+    }
+
+
+def import_time(module: str) -> float:
+    """Return the time (in seconds) it takes to import a module \
+    in a new interpreter, as reported by ``python -X importtime``."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent,
+    ).stderr
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ValueError(f"no import time reported for '{module}'")
+
+
+def check_startup(repeats: int = REPEATS) -> dict:
+    """Measure the import time of the modules in STARTUP_BUDGETS."""
+    results = {}
+    for module, budget in STARTUP_BUDGETS.items():
+        fastest = min(import_time(module) for _ in range(repeats))
+        results[module] = {
+            "import_time": fastest,
+            "budget": budget,
+            "within_budget": fastest <= budget,
+        }
+    return results
+
+
+def git_commit() -> tuple[str, bool]:
+    """Return the current commit and whether the work tree has changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, bool(status)
+
+
+def compare(previous: dict, current: dict) -> None:
+    """Print the speedup of each benchmark between two results."""
+    header = ["previous (s)", "current (s)", "speedup"]
+    print(f"{'benchmark':<28}{header[0]:>14}{header[1]:>14}{header[2]:>10}")
+    for name, result in current["results"].items():
+        if name not in previous["results"]:
+            continue
+        before = previous["results"][name]["min"]
+        after = result["min"]
+        speedup = f"{before / after:.2f}x" if after else "n/a"
+        print(f"{name:<28}{before:>14.4f}{after:>14.4f}{speedup:>10}")
+
+
+def main(
+    nb_datasets: int = typer.Option(100, help="Number of datasets"),
+    nb_rows: int = typer.Option(100, help="Number of participants"),
+    nb_columns: int = typer.Option(10, help="Number of columns"),
+    nb_levels: int = typer.Option(5, help="Levels of categorical columns"),
+    json_coverage: float = typer.Option(
+        0.5, help="Proportion of datasets with a participants.json"
+    ),
+    seed: int = typer.Option(0, help="Seed of the corpus generator"),
+    repeats: int = typer.Option(REPEATS, help="Runs of each benchmark"),
+    only: list[str] = typer.Option(
+        None, help=f"Benchmarks to run among: {', '.join(BENCHMARKS)}"
+    ),
+    output: Path = typer.Option(None, help="JSON file to save the results to"),
+    compare_to: Path = typer.Option(
+        None, "--compare", help="Previous results to compare with"
+    ),
+    startup: bool = typer.Option(
+        True, help="Check the import time of the per-dataset scripts"
+    ),
+):
+    """Benchmark the annotation pipeline on a synthetic corpus."""
+    # logs of each dataset would drown the results
+    logging.getLogger("rich").setLevel(logging.WARNING)
+
+    corpus = {
+        "nb_datasets": nb_datasets,
+        "nb_rows": nb_rows,
+        "nb_columns": nb_columns,
+        "nb_levels": nb_levels,
+        "json_coverage": json_coverage,
+        "seed": seed,
+    }
+    names = only or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise typer.BadParameter(
+            f"unknown benchmarks: {sorted(unknown)}", param_hint="--only"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        openneuro = generate_corpus(Path(tmp_dir), **corpus)
+        context = prepare_context(openneuro, Path(tmp_dir))
+
+        results = {}
+        for name in names:
+            results[name] = run_benchmark(BENCHMARKS[name], context, repeats)
+            print(
+                f"{name:<28}{results[name]['min']:>10.4f} s "
+                f"({results[name]['nb_items']} items)"
+            )
+
+    startup_results = {}
+    if startup:
+        startup_results = check_startup(repeats)
+        for module, result in startup_results.items():
+            status = "ok" if result["within_budget"] else "OVER BUDGET"
+            print(
+                f"import {module:<26}{result['import_time']:>10.4f} s "
+                f"(budget: {result['budget']} s) {status}"
+            )
+
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "corpus": corpus,
+        "repeats": repeats,
+        "results": results,
+        "startup": startup_results,
+    }
+
+    if output is None:
+        output = (
+            output_dir()
+            / "benchmarks"
+            / f"{datetime.now():%Y%m%d-%H%M%S}_{commit}.json"
+        )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results saved in {output}")
+
+    if compare_to is not None:
+        with open(compare_to) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    typer.run(main)
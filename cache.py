@@ -0,0 +1,113 @@
+"""On-disk cache of the rows listed for each dataset.
+
+Cache entries are keyed by:
+- the content of the participants.tsv / participants.json of a dataset
+  (or their git-annex key if they are annexed),
+- the source code of the modules used to list the rows,
+
+so that a new scan only has to process the datasets that changed.
+"""
+
+import hashlib
+import json
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+import pandas as pd
+
+from heuristics import RULES_FILES
+from utils import exclude_datasets, output_dir
+
+# files whose content affects the rows listed for a dataset
+CODE_FILES = [
+    Path(__file__).parent / "heuristics.py",
+    Path(__file__).parent / "utils.py",
+    *RULES_FILES,
+]
+
+
+def cache_dir() -> Path:
+    return output_dir() / ".cache"
+
+
+def file_key(pth: Path) -> str:
+    """Return the git-annex key of a file if it is annexed, \
+    otherwise the sha256 of its content."""
+    if pth.is_symlink():
+        target = Path(os.readlink(pth))
+        if ".git/annex/objects" in target.as_posix():
+            return target.name
+    return hashlib.sha256(pth.read_bytes()).hexdigest()
+
+
+def code_version(code_files: list[Path]) -> str:
+    """Return a hash of the content of the source files."""
+    sha = hashlib.sha256()
+    for pth in code_files:
+        sha.update(pth.read_bytes())
+    return sha.hexdigest()
+
+
+def participants_files(dataset: pd.Series, src_pth: Path) -> list[Path]:
+    """Return the participants files used to list the rows of a dataset."""
+    files = [src_pth / dataset["name"] / "participants.tsv"]
+    if dataset["has_participant_json"]:
+        files.append(src_pth / dataset["name"] / "participants.json")
+    return files
+
+
+def dataset_key(files: list[Path], code_files: list[Path]) -> str:
+    sha = hashlib.sha256(code_version(code_files).encode())
+    for pth in files:
+        sha.update(pth.name.encode())
+        sha.update(file_key(pth).encode())
+    return sha.hexdigest()
+
+
+def load_rows(cache_file: Path, key: str) -> dict[str, list] | None:
+    """Return the cached rows if the cache entry matches the key."""
+    if not cache_file.exists():
+        return None
+    with open(cache_file) as f:
+        entry = json.load(f)
+    if entry.get("key") != key:
+        return None
+    return entry["rows"]
+
+
+def save_rows(cache_file: Path, key: str, rows: dict[str, list]) -> None:
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"key": key, "rows": rows}, f)
+    tmp_file.replace(cache_file)
+
+
+def get_rows(
+    list_rows: Callable[[pd.Series, Path], dict[str, list]],
+    dataset: pd.Series,
+    src_pth: Path,
+    cache: Path,
+    code_files: list[Path],
+) -> dict[str, list]:
+    """Return the rows listed by ``list_rows`` for a dataset.
+
+    The rows are read from the cache if the participants files
+    and the code used to list them did not change since they were cached.
+    """
+    if exclude_datasets(dataset):
+        return list_rows(dataset, src_pth)
+
+    try:
+        key = dataset_key(participants_files(dataset, src_pth), code_files)
+    except OSError:
+        return list_rows(dataset, src_pth)
+
+    cache_file = cache / f"{dataset['name']}.json"
+    if (rows := load_rows(cache_file, key)) is not None:
+        return rows
+
+    rows = list_rows(dataset, src_pth)
+    save_rows(cache_file, key, rows)
+    return rows
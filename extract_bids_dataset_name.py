@@ -1,34 +1,100 @@
-"""Fetch and print the name of a BIDS dataset."""
+"""Fetch and print the name of a BIDS dataset.
 
+By default only the dataset_description.json of the dataset is read
+and checked for the mandatory "Name" and "BIDSVersion" fields
+(the same checks as BIDSLayout(ds, validate=True) does on that file),
+instead of indexing the whole dataset with pybids.
+
+When several datasets are passed (or with --tsv), prints a TSV mapping
+each dataset directory name to its name ("None" if it has no valid name).
+The TSV is not quoted as parallel_bagel.sh reads it with `read -r`:
+tabs and line breaks in the names are replaced by spaces.
+"""
+
+import json
 from pathlib import Path
 
 import typer
-from bids import BIDSLayout
-from bids.exceptions import BIDSValidationError
+
+# fields a dataset_description.json must have
+MANDATORY_FIELDS = ["Name", "BIDSVersion"]
+
+
+def get_dataset_name(ds: Path, use_layout: bool = False) -> str | None:
+    """Return the name of a BIDS dataset from its dataset_description.json.
+
+    Returns None if the dataset is not valid or has no name.
+
+    If ``use_layout`` is True, the dataset is indexed and validated
+    with pybids BIDSLayout first (much slower).
+    pybids is only imported in that case,
+    as importing it takes longer than reading the description.
+    """
+    if not use_layout:
+        description = read_dataset_description(ds)
+        if description is None:
+            return None
+        return description.get("Name") or None
+
+    from bids import BIDSLayout
+    from bids.exceptions import BIDSValidationError
+
+    # NOTE: Validation will fail if dataset lacks a dataset_description.json or if the "Name" key is missing.
+    try:
+        layout = BIDSLayout(ds, validate=True)
+    except BIDSValidationError:
+        return None
+
+    return layout.get_dataset_description().get("Name") or None
+
+
+def read_dataset_description(ds: Path) -> dict | None:
+    """Return the content of the dataset_description.json of a dataset.
+
+    Returns None if the file is missing, is not valid JSON
+    or lacks one of the MANDATORY_FIELDS.
+    """
+    try:
+        with open(ds / "dataset_description.json", encoding="utf-8") as f:
+            description = json.load(f)
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    if not isinstance(description, dict) or any(
+        field not in description for field in MANDATORY_FIELDS
+    ):
+        return None
+    return description
 
 
 def main(
-    ds: Path = typer.Option(
+    ds: list[Path] = typer.Option(
         ...,
-        help="Path to a BIDS dataset directory",
+        help="Path to a BIDS dataset directory (can be repeated)",
         exists=True,
         file_okay=False,
         dir_okay=True,
-    )
+    ),
+    use_layout: bool = typer.Option(
+        False, help="Validate the datasets with pybids BIDSLayout (slow)"
+    ),
+    tsv: bool = typer.Option(
+        False, help="Print a TSV mapping even for a single dataset"
+    ),
 ):
     """Fetch and print the name of a BIDS dataset from the dataset_description.json."""
-    # NOTE: Validation will fail if dataset lacks a dataset_description.json or if the "Name" key is missing.
-    try:
-        layout = BIDSLayout(ds, validate=True)
-    except BIDSValidationError:
-        print("None")
+    if len(ds) == 1 and not tsv:
+        print(get_dataset_name(ds[0], use_layout) or "None")
         return
 
-    name = layout.get_dataset_description().get("Name")
-    if name == "":
-        print("None")
-    else:
-        print(name)
+    print("dataset\tname")
+    for pth in ds:
+        name = get_dataset_name(pth, use_layout) or "None"
+        print(f"{pth.name}\t{tsv_field(name)}")
+
+
+def tsv_field(value: str) -> str:
+    """Replace the tabs and line breaks of a value by spaces."""
+    return " ".join(value.replace("\t", "\n").splitlines())
 
 
 if __name__ == "__main__":
@@ -5,12 +5,16 @@ variables that are under different names but probably mean the same thing.
 
 """
 
+import json
 import re
+from pathlib import Path
 
 import pandas as pd
 
+from instrumentation import timed
+
 NEUROBAGEL = {
-    "nb:ParticipantID": ("participant"),
+    "nb:ParticipantID": ("participant",),
     "nb:SessionID": ("session", "session_id"),
     "nb:Sex": (
         "gender",
@@ -77,11 +81,121 @@ NEUROBAGEL = {
         "hand",
         "handedness",
     ),
-    "nb:Diagnosis": ("diagnosis"),
-    "purl:NCIT_C94342": ("healthy_control"),
-    "nb:Assessment": ("assessment_tool"),
+    "nb:Diagnosis": ("diagnosis",),
+    "purl:NCIT_C94342": ("healthy_control",),
+    "nb:Assessment": ("assessment_tool",),
 }
 
+# regular expressions of column names for each controlled term
+#
+# Matched against the whole normalized column name
+# (see normalize_column_name), for example:
+# {"nb:Age": [r"age_ses-t[0-9]+"]}
+NEUROBAGEL_PATTERNS: dict[str, list[str]] = {}
+
+# JSON files with extra rules to register on import, with the format:
+# {"controlled term": ["synonym", ...]}
+# or
+# {"controlled term": {"names": ["synonym", ...], "patterns": ["regex", ...]}}
+RULES_FILES: list[Path] = []
+
+
+def normalize_column_name(column: str) -> str:
+    return column.strip().lower()
+
+
+class RuleRegistry:
+    """Map column names to controlled terms.
+
+    All synonyms are normalized in a single lookup table
+    and all patterns are compiled in a single regular expression,
+    so that matching a column does not depend on the number of rules.
+    """
+
+    def __init__(self):
+        self.names: dict[str, str] = {}
+        self.patterns: list[tuple[str, str]] = []
+        self._regex: re.Pattern | None = None
+
+    def add(
+        self,
+        rules: dict[str, list[str] | tuple[str, ...] | dict[str, list[str]]],
+    ) -> None:
+        """Add rules with the format of RULES_FILES.
+
+        Raises a ValueError if a column name is already
+        a synonym of another controlled term.
+        """
+        for term, synonyms in rules.items():
+            if isinstance(synonyms, dict):
+                names = synonyms.get("names", [])
+                patterns = synonyms.get("patterns", [])
+            else:
+                names, patterns = synonyms, []
+            if isinstance(names, str):
+                raise ValueError(
+                    f"synonyms of '{term}' must be a list, got '{names}'"
+                )
+
+            for name in names:
+                name = normalize_column_name(name)
+                if self.names.get(name, term) != term:
+                    raise ValueError(
+                        f"'{name}' cannot be a synonym of '{term}': "
+                        f"it is already a synonym of '{self.names[name]}'"
+                    )
+                self.names[name] = term
+            for pattern in patterns:
+                re.compile(pattern)
+                self.patterns.append((pattern, term))
+        self._regex = None
+
+    def register(self, path: Path) -> None:
+        """Add the rules of a JSON file."""
+        with open(path) as f:
+            self.add(json.load(f))
+
+    def match(self, column: str) -> str | None:
+        """Return the controlled term of a column name or None."""
+        column = normalize_column_name(column)
+        if term := self.names.get(column):
+            return term
+        if not self.patterns:
+            return None
+        if self._regex is None:
+            self._regex = re.compile(
+                "|".join(
+                    f"(?P<rule{i}>{pattern})"
+                    for i, (pattern, _) in enumerate(self.patterns)
+                )
+            )
+        if match := self._regex.fullmatch(column):
+            return self.patterns[int(match.lastgroup[4:])][1]
+        return None
+
+
+RULES = RuleRegistry()
+RULES.add(NEUROBAGEL)
+RULES.add({term: {"patterns": x} for term, x in NEUROBAGEL_PATTERNS.items()})
+for rules_file in RULES_FILES:
+    RULES.register(rules_file)
+
+
+def register_rules(path: Path) -> None:
+    """Add the rules of a JSON file to the default rules.
+
+    Rules registered this way are not seen by worker processes
+    started with 'spawn' nor by the cache of listed rows:
+    add the file to RULES_FILES instead to use it in every scan.
+    """
+    RULES.register(path)
+
+
+def match_controlled_term(column: str) -> str | None:
+    """Return the controlled term whose synonyms include the column name."""
+    return RULES.match(column)
+
+
 # the following is more manually curated to avoid indexing
 # the labels of columns that should not be.
 COLUMNS_TO_SKIP = {
@@ -160,47 +274,110 @@ def get_levels_from_data_dict(participants_dict: dict, column: str) -> dict:
         return {}
 
 
+# values a "binary" column can take (after stripping and lowercasing)
+YES_NO_LEVELS = ["no", "yes", "y", "n", "0", "1"]
+
+# heuristics for columns whose levels are all strings, in order of priority:
+# (type, pattern all levels must match, pattern one level must match)
+#
+# patterns are matched against the stripped levels
+STR_COLUMN_TYPES = [
+    ("nb:euro", "^[- 0-9,]*$", "^[-]?[ ]?[0-9]*,[0-9]*$"),
+    ("int", "^[0-9]*$|^[.-]{1}$", None),
+    ("nb:bounded", "^[+0-9.]*$", "^[0-9]*[.]?[0-9]*[+]$"),
+    ("nb:range", "^[-0-9]*$", "^[0-9]*-{1}[0-9]+$"),
+    ("ageY", "^[0-9]+Y$", None),
+    ("ratio", "^([0-9]+(/){0-1})*$", None),
+]
+
+
+@timed
 def get_column_type(col: pd.Series):
     """Return column type.
 
     Will run most of the heuristics to detect the column type.
+
+    The unique non-null values of the column are only computed once
+    and stripped once before being checked against each heuristic.
     """
     col_type = str(col.dtype)
-    if col_type in {"object", "n/a"}:
-        if is_yes_no(col):
-            col_type = "yes_no"
-        elif is_euro_format(col):
-            col_type = "nb:euro"
-        elif is_int(col):
-            col_type = "int"
-        elif is_float(col):
-            col_type = "float"
-        elif is_bounded(col):
-            col_type = "nb:bounded"
-        elif is_range(col):
-            col_type = "nb:range"
-        elif is_age_with_Y(col):
-            col_type = "ageY"
-        elif is_ratio(col):
-            col_type = "ratio"
+    if col_type not in {"object", "n/a"}:
+        return col_type
+
+    levels = unique_levels(col)
+
+    if not are_str(levels):
+        if _is_yes_no(levels):
+            return "yes_no"
+        if _all_instances(levels, int):
+            return "int"
+        if _all_instances(levels, float):
+            return "float"
+        return col_type
+
+    levels = levels.str.strip()
+    if _is_yes_no_str(levels):
+        return "yes_no"
+    for str_type, all_pattern, any_pattern in STR_COLUMN_TYPES:
+        if _match_levels(levels, all_pattern, any_pattern):
+            return str_type
     return col_type
 
 
+def unique_levels(col: pd.Series) -> pd.Series:
+    """Return the unique non-null values of a column."""
+    return pd.Series(col.dropna().unique(), dtype=object)
+
+
+def are_str(levels: pd.Series) -> bool:
+    """Return True if levels are not empty and are all strings."""
+    return pd.api.types.infer_dtype(levels, skipna=False) == "string"
+
+
+def _all_instances(levels: pd.Series, type_: type) -> bool:
+    return all(isinstance(x, type_) for x in levels)
+
+
+def _match_levels(
+    levels: pd.Series, all_pattern: str, any_pattern: str | None = None
+) -> bool:
+    """Return True if all stripped string levels match ``all_pattern`` \
+    and at least one matches ``any_pattern``."""
+    if not levels.str.match(all_pattern).all():
+        return False
+    return any_pattern is None or bool(levels.str.match(any_pattern).any())
+
+
+def _is_str_type(col: pd.Series, str_type: str) -> bool:
+    """Return True if all non-null values of a column are strings \
+    that pass the heuristic for ``str_type`` in STR_COLUMN_TYPES."""
+    levels = unique_levels(col)
+    if len(levels) and not are_str(levels):
+        return False
+    _, all_pattern, any_pattern = next(
+        x for x in STR_COLUMN_TYPES if x[0] == str_type
+    )
+    return _match_levels(levels.str.strip(), all_pattern, any_pattern)
+
+
+def _is_yes_no_str(levels: pd.Series) -> bool:
+    return bool(levels.str.lower().isin(YES_NO_LEVELS).all())
+
+
+def _is_yes_no(levels: pd.Series) -> bool:
+    if are_str(levels):
+        return _is_yes_no_str(levels.str.strip())
+    return all(isinstance(x, int) and x in [0, 1] for x in levels) or all(
+        isinstance(x, float) and x in [0.0, 1.0] for x in levels
+    )
+
+
 def is_yes_no(col: pd.Series) -> bool:
     """Return True for 'binary' columns.
 
     NaN are dropped before checking.
     """
-    col = col.dropna()
-    return (
-        all(
-            isinstance(x, str)
-            and x.strip().lower() in ["no", "yes", "y", "n", "0", "1"]
-            for x in col.unique()
-        )
-        or all(isinstance(x, int) and x in [0, 1] for x in col.unique())
-        or all(isinstance(x, float) and x in [0.0, 1.0] for x in col.unique())
-    )
+    return _is_yes_no(unique_levels(col))
 
 
 def is_euro_format(col: pd.Series) -> bool:
@@ -208,21 +385,11 @@ def is_euro_format(col: pd.Series) -> bool:
 
     NaN are dropped before checking.
     """
-    col = col.dropna()
-    return all(
-        isinstance(x, str) and re.match("^[- 0-9,]*$", x.strip())
-        for x in col.unique()
-    ) and any(
-        re.match("^[-]?[ ]?[0-9]*,[0-9]*$", x.strip()) for x in col.unique()
-    )
+    return _is_str_type(col, "nb:euro")
 
 
 def is_age_with_Y(col: pd.Series) -> bool:
-    col = col.dropna()
-    return all(
-        isinstance(x, str) and re.match("^[0-9]+Y$", x.strip())
-        for x in col.unique()
-    )
+    return _is_str_type(col, "ageY")
 
 
 def is_bounded(col: pd.Series) -> bool:
@@ -230,13 +397,7 @@ def is_bounded(col: pd.Series) -> bool:
 
     NaN are dropped before checking.
     """
-    col = col.dropna()
-    return all(
-        isinstance(x, str) and re.match("^[+0-9.]*$", x.strip())
-        for x in col.unique()
-    ) and any(
-        re.match("^[0-9]*[.]?[0-9]*[+]$", x.strip()) for x in col.unique()
-    )
+    return _is_str_type(col, "nb:bounded")
 
 
 def is_range(col: pd.Series) -> bool:
@@ -245,11 +406,7 @@ def is_range(col: pd.Series) -> bool:
 
     NaN are dropped before checking.
     """
-    col = col.dropna()
-    return all(
-        isinstance(x, str) and re.match("^[-0-9]*$", x.strip())
-        for x in col.unique()
-    ) and any(re.match("^[0-9]*-{1}[0-9]+$", x.strip()) for x in col.unique())
+    return _is_str_type(col, "nb:range")
 
 
 def is_ratio(col: pd.Series) -> bool:
@@ -257,11 +414,7 @@ def is_ratio(col: pd.Series) -> bool:
 
     NaN are dropped before checking.
     """
-    col = col.dropna()
-    return all(
-        isinstance(x, str) and re.match("^([0-9]+(/){0-1})*$", x.strip())
-        for x in col.unique()
-    )
+    return _is_str_type(col, "ratio")
 
 
 def is_participant_id(df: pd.DataFrame, column: str) -> bool:
@@ -279,10 +432,10 @@ def is_participant_id(df: pd.DataFrame, column: str) -> bool:
     )
 
 
-def is_age(this_row: dict):
-    if this_row["column"].lower() not in NEUROBAGEL["nb:Age"]:
+def is_age(this_row: dict) -> bool:
+    if match_controlled_term(this_row["column"]) != "nb:Age":
         return False
-    if this_row["type"] in [
+    return this_row["type"] in [
         "float64",
         "int64",
         "int",
@@ -290,13 +443,11 @@ def is_age(this_row: dict):
         "nb:bounded",
         "nb:euro",
         "ageY",
-    ]:
-        return True
+    ]
 
 
-def is_sex(column: str):
-    if column.strip().lower() in NEUROBAGEL["nb:Sex"]:
-        return True
+def is_sex(column: str) -> bool:
+    return match_controlled_term(column) == "nb:Sex"
 
 
 def is_int(levels):
@@ -304,13 +455,10 @@ def is_int(levels):
 
     Will also return true if the values just either a dot or a dash.
     """
-    levels = levels.dropna()
-    return all(isinstance(x, (int)) for x in levels.unique()) or all(
-        isinstance(x, (str)) and re.match("^[0-9]*$|^[.-]{1}$", x.strip())
-        for x in levels.unique()
+    return _all_instances(unique_levels(levels), int) or _is_str_type(
+        levels, "int"
     )
 
 
 def is_float(levels):
-    levels = levels.dropna()
-    return all(isinstance(x, (float)) for x in levels.unique())
+    return _all_instances(unique_levels(levels), float)
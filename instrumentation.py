@@ -0,0 +1,190 @@
+"""Opt-in timing of the stages of a run.
+
+Instrumentation is off unless the BULK_ANNOTATION_TRACE environment variable
+is set to the path of a JSON-lines file, for example:
+
+    BULK_ANNOTATION_TRACE=outputs/trace.jsonl python scan_participants.py
+
+Each stage (reading a participants.tsv, typing a column, listing its levels...)
+is then appended to that file as one event in the Chrome trace format
+with its wall time and details (dataset, column, number of rows and columns).
+Events of worker processes are appended to the same file.
+
+At the end of a run, the events are also exported as a Chrome trace
+(``{trace}_chrome.json``, to open in chrome://tracing or Perfetto)
+and a summary of the slowest stages, datasets and columns is printed.
+
+When instrumentation is off, stages only cost a function call.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+TRACE_ENV = "BULK_ANNOTATION_TRACE"
+
+# JSON-lines file the events are appended to (None to disable)
+TRACE_FILE: Path | None = (
+    Path(os.environ[TRACE_ENV]) if os.environ.get(TRACE_ENV) else None
+)
+
+# number of slowest datasets and columns listed in the summary
+TOP_N = 10
+
+# stage timing a whole dataset / column
+DATASET_STAGE = "scan_dataset"
+COLUMN_STAGE = "column"
+
+_trace = {"pid": None, "file": None}
+_lock = threading.Lock()
+
+
+@contextmanager
+def stage(name: str, **args) -> Iterator[dict]:
+    """Time the block of code as a stage called ``name``.
+
+    ``args`` (dataset, column...) are saved with the event;
+    the dictionary yielded can be updated in the block
+    to add details only known at the end (number of rows...).
+    """
+    if TRACE_FILE is None:
+        yield args
+        return
+
+    ts = time.time_ns() // 1000
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        record(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": ts,
+                "dur": (time.perf_counter_ns() - start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+
+def timed(func: Callable | None = None, *, name: str | None = None):
+    """Decorate a function to time each of its calls as a stage.
+
+    The stage is named after the function unless ``name`` is passed.
+    """
+    if func is None:
+        return functools.partial(timed, name=name)
+
+    stage_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if TRACE_FILE is None:
+            return func(*args, **kwargs)
+        with stage(stage_name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def record(event: dict) -> None:
+    """Append an event to the trace file."""
+    line = json.dumps(event, default=str) + "\n"
+    with _lock:
+        # file handles are not shared with forked worker processes
+        if _trace["pid"] != os.getpid():
+            _trace["file"] = open(TRACE_FILE, "a", buffering=1)
+            _trace["pid"] = os.getpid()
+        _trace["file"].write(line)
+
+
+def reset() -> None:
+    """Empty the trace file at the beginning of a run."""
+    if TRACE_FILE is None:
+        return
+    close()
+    TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    TRACE_FILE.write_text("")
+
+
+def close() -> None:
+    with _lock:
+        if _trace["file"] is not None and _trace["pid"] == os.getpid():
+            _trace["file"].close()
+        _trace["pid"] = None
+        _trace["file"] = None
+
+
+def load_events(trace_file: Path) -> pd.DataFrame:
+    """Return the events of a trace file, with their args as columns."""
+    with open(trace_file) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    df = pd.json_normalize(events)
+    return df.rename(columns={c: c.removeprefix("args.") for c in df.columns})
+
+
+def export_chrome_trace(trace_file: Path, output: Path) -> None:
+    """Convert a JSON-lines trace file into a Chrome trace file."""
+    with open(trace_file) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def summarize(events: pd.DataFrame, top: int = TOP_N) -> str:
+    """Return a summary of the slowest stages, datasets and columns."""
+    events = events.assign(ms=events["dur"] / 1000)
+    lines = []
+
+    stages = (
+        events.groupby("name")["ms"]
+        .agg(["count", "sum", "mean", "max"])
+        .sort_values("sum", ascending=False)
+    )
+    lines += ["time per stage (ms):", stages.round(2).to_string(), ""]
+
+    for stage_name, keys in [
+        (DATASET_STAGE, ["dataset", "rows", "columns"]),
+        (COLUMN_STAGE, ["dataset", "column", "rows"]),
+    ]:
+        slowest = events[events["name"] == stage_name]
+        if slowest.empty:
+            continue
+        keys = [k for k in keys if k in slowest.columns]
+        slowest = slowest.nlargest(top, "ms")[[*keys, "ms"]].convert_dtypes()
+        lines += [
+            f"{top} slowest {stage_name} (ms):",
+            slowest.round(2).to_string(index=False),
+            "",
+        ]
+
+    return "\n".join(lines)
+
+
+def report(top: int = TOP_N) -> str | None:
+    """Export the trace of a run as a Chrome trace and print its summary.
+
+    Returns the summary (None if instrumentation is off or no event).
+    """
+    if TRACE_FILE is None:
+        return None
+    close()
+    if not TRACE_FILE.exists() or TRACE_FILE.stat().st_size == 0:
+        return None
+
+    chrome_trace = TRACE_FILE.with_name(f"{TRACE_FILE.stem}_chrome.json")
+    export_chrome_trace(TRACE_FILE, chrome_trace)
+
+    summary = summarize(load_events(TRACE_FILE), top)
+    print(summary)
+    print(f"trace saved in {TRACE_FILE} and {chrome_trace}")
+    return summary
@@ -7,17 +7,23 @@ TODO:
 - properly use datalad.api to install datasets
 """
 
+import csv
+import os
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from warnings import warn
 
-import datalad.api as dlapi
 import pandas as pd
-from rich import print
 
-from utils import output_dir
+from utils import save_table
 
 VERBOSE = False
 
+# number of threads used to index datasets:
+# datasets are indexed serially when set to 1
+N_JOBS = 1
+
 # adapt to your set up
 # LOCAL_DIR = Path(__file__).resolve().parent / "inputs"
 LOCAL_DIR = "/home/remi/datalad/datasets.datalad.org"
@@ -25,6 +31,9 @@ LOCAL_DIR = "/home/remi/datalad/datasets.datalad.org"
 URL_OPENNEURO = "https://github.com/OpenNeuroDatasets/"
 URL_OPENNEURO_DERIVATIVES = "https://github.com/OpenNeuroDerivatives/"
 
+# modality folders that flag a subject as having MRI data
+MRI_FOLDERS = {"anat", "dwi", "func", "perf"}
+
 
 def init_dataset() -> dict[str, list]:
     return {
@@ -48,30 +57,102 @@ def main():
     datasets = init_dataset()
     datasets = list_openneuro(datalad_superdataset, datasets)
     datasets = pd.DataFrame.from_dict(datasets)
-    datasets.to_csv(output_dir() / "openneuro.tsv", index=False, sep="\t")
+    save_table(datasets, "openneuro")
 
     datasets = init_dataset()
     datasets = list_openneuro_derivatives(datalad_superdataset, datasets)
     datasets = pd.DataFrame.from_dict(datasets)
-    datasets.to_csv(
-        output_dir() / "openneuro_derivatives.tsv",
-        index=False,
-        sep="\t",
-    )
+    save_table(datasets, "openneuro_derivatives")
 
 
 def has_mri(bids_pth: Path) -> bool:
     """Return True if at least one subject has at least one MRI modality folder."""
-    return bool(
-        list(bids_pth.glob("sub*/func"))
-        or list(bids_pth.glob("sub*/ses*/func"))
-        or list(bids_pth.glob("sub*/anat"))
-        or list(bids_pth.glob("sub*/ses*/anat"))
-        or list(bids_pth.glob("sub*/dwi"))
-        or list(bids_pth.glob("sub*/ses*/dwi"))
-        or list(bids_pth.glob("sub*/perf"))
-        or list(bids_pth.glob("sub*/ses*/perf"))
-    )
+    return index_dataset(bids_pth)["has_mri"]
+
+
+def index_dataset(
+    bids_pth: Path, scan_subjects: bool = True, stop_at_mri: bool = True
+) -> dict[str, bool | list[str]]:
+    """List the content of a dataset visiting each of its folders at most once.
+
+    Returns a dict with:
+    - subjects: names of the 'sub-*' folders
+    - sessions: 'sub*/ses*' folders
+    - mri_folders: 'sub*/func', 'sub*/ses*/anat'... folders
+    - has_mri: True if at least one subject has an MRI modality folder
+    - derivatives: names of the content of the 'derivatives' folder
+    - has_participant_tsv, has_participant_json, has_phenotype_dir
+
+    If ``scan_subjects`` is False, subject folders are not visited.
+
+    If ``stop_at_mri`` is True, subject folders stop being visited
+    as soon as an MRI modality folder is found,
+    so sessions and mri_folders are only partially listed.
+    """
+    index = {
+        "subjects": [],
+        "sessions": [],
+        "mri_folders": [],
+        "has_mri": False,
+        "derivatives": [],
+        "has_participant_tsv": False,
+        "has_participant_json": False,
+        "has_phenotype_dir": False,
+    }
+
+    subject_dirs = []
+    for entry in _scandir(bids_pth):
+        if entry.name.startswith("sub"):
+            if not entry.is_dir():
+                continue
+            subject_dirs.append(entry)
+            if entry.name.startswith("sub-"):
+                index["subjects"].append(entry.name)
+        elif entry.name == "participants.tsv":
+            index["has_participant_tsv"] = entry.is_file()
+        elif entry.name == "participants.json":
+            index["has_participant_json"] = entry.is_file()
+        elif entry.name == "phenotype":
+            index["has_phenotype_dir"] = entry.is_dir()
+        elif entry.name == "derivatives" and entry.is_dir():
+            index["derivatives"] = [x.name for x in _scandir(entry.path)]
+
+    if not scan_subjects:
+        return index
+
+    # breadth first: look for modality folders of all subjects
+    # before looking into their sessions
+    session_dirs = []
+    for subject_dir in subject_dirs:
+        for entry in _scandir(subject_dir.path):
+            if entry.name in MRI_FOLDERS:
+                index["mri_folders"].append(f"{subject_dir.name}/{entry.name}")
+                index["has_mri"] = True
+                if stop_at_mri:
+                    return index
+            elif entry.name.startswith("ses") and entry.is_dir():
+                session = f"{subject_dir.name}/{entry.name}"
+                index["sessions"].append(session)
+                session_dirs.append((session, entry))
+
+    for session, session_dir in session_dirs:
+        for entry in _scandir(session_dir.path):
+            if entry.name in MRI_FOLDERS:
+                index["mri_folders"].append(f"{session}/{entry.name}")
+                index["has_mri"] = True
+                if stop_at_mri:
+                    return index
+
+    return index
+
+
+def _scandir(pth: Path | str) -> list[os.DirEntry]:
+    """List the entries of a folder or nothing if it cannot be listed."""
+    try:
+        with os.scandir(pth) as entries:
+            return list(entries)
+    except OSError:
+        return []
 
 
 def new_dataset(name: str) -> dict[str, str | int | bool | list[str]]:
@@ -90,18 +171,82 @@ def new_dataset(name: str) -> dict[str, str | int | bool | list[str]]:
     }
 
 
-def list_participants_tsv_columns(participant_tsv: Path) -> list[str]:
-    """Return the list of columns in participants.tsv."""
+def list_participants_tsv_columns(
+    participant_tsv: Path, count_rows: bool = False
+) -> list[str] | tuple[list[str], int]:
+    """Return the list of columns in participants.tsv.
+
+    Only the header is read,
+    unless it is malformed and the whole file must be parsed.
+
+    If ``count_rows`` is True, also return the number of rows in the file.
+    """
+    columns = read_tsv_header(participant_tsv)
+    if columns is None:
+        try:
+            df = pd.read_csv(participant_tsv, sep="\t")
+            columns = df.columns.tolist()
+        except pd.errors.ParserError:
+            warn(f"Could not parse: {participant_tsv}")
+            columns = ["cannot be parsed"]
+
+    if count_rows:
+        return columns, count_tsv_rows(participant_tsv)
+    return columns
+
+
+def read_tsv_header(tsv: Path) -> list[str] | None:
+    """Return the column names in the first line of a TSV file.
+
+    Returns None if the header cannot be read as is
+    (blank line, empty or duplicated column names, bad encoding),
+    as pandas would skip or rename those.
+    """
     try:
-        df = pd.read_csv(participant_tsv, sep="\t")
-        return df.columns.tolist()
-    except pd.errors.ParserError:
-        warn(f"Could not parse: {participant_tsv}")
-        return ["cannot be parsed"]
+        with open(tsv, encoding="utf-8-sig", newline="") as f:
+            header = next(csv.reader(f, delimiter="\t"), None)
+    except (UnicodeDecodeError, csv.Error):
+        return None
+    if not header or "" in header or len(set(header)) != len(header):
+        return None
+    return header
+
+
+def count_tsv_rows(tsv: Path, chunk_size: int = 1 << 20) -> int:
+    """Return the number of lines after the header of a TSV file.
+
+    Lines are counted by scanning the file in binary chunks:
+    blank lines and line breaks within quoted values are counted as rows.
+    """
+    nb_lines = 0
+    last_chunk = b""
+    with open(tsv, "rb") as f:
+        while chunk := f.read(chunk_size):
+            nb_lines += chunk.count(b"\n")
+            last_chunk = chunk
+    if last_chunk and not last_chunk.endswith(b"\n"):
+        nb_lines += 1
+    return max(nb_lines - 1, 0)
+
+
+def map_datasets(
+    func: Callable[[Path], dict], dataset_pths: list[Path], n_jobs: int = 1
+) -> Iterator[dict]:
+    """Yield ``func(dataset_pth)`` for each dataset in the order of ``dataset_pths``.
+
+    If ``n_jobs`` is greater than 1,
+    datasets are processed by a pool of ``n_jobs`` threads.
+    """
+    if n_jobs <= 1:
+        yield from map(func, dataset_pths)
+        return
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        yield from executor.map(func, dataset_pths)
 
 
 def list_openneuro(
-    datalad_superdataset: Path, datasets: dict[str, list]
+    datalad_superdataset: Path, datasets: dict[str, list], n_jobs: int = N_JOBS
 ) -> dict[str, list]:
     """Indexes content of dataset on openneuro.
 
@@ -112,41 +257,50 @@ def list_openneuro(
 
     raw_datasets = sorted(list(openneuro.glob("ds*")))
 
-    for dataset_pth in raw_datasets:
-        dataset_name = dataset_pth.name
-
-        dataset = new_dataset(dataset_name)
-        dataset["nb_subjects"] = get_nb_subjects(dataset_pth)
-        dataset["has_mri"] = has_mri(dataset_pth)
-
-        tsv_status, json_status, columns = has_participant_tsv(dataset_pth)
-        dataset["has_participant_tsv"] = tsv_status
-        dataset["has_participant_json"] = json_status
-        dataset["participant_columns"] = columns
-        dataset["has_phenotype_dir"] = bool(
-            (dataset_pth / "phenotype").exists()
-        )
-
-        for der in [
-            "fmriprep",
-            "freesurfer",
-            "mriqc",
-        ]:
-            if der_datasets := dataset_pth.glob(f"derivatives/*{der}*"):
-                for i in der_datasets:
-                    dataset[
-                        der
-                    ] = f"{URL_OPENNEURO}{dataset_name}/tree/main/derivatives/{i.name}"
-
+    for dataset in map_datasets(describe_raw_dataset, raw_datasets, n_jobs):
         for keys in datasets:
             datasets[keys].append(dataset[keys])
 
     return datasets
 
 
-def has_participant_tsv(pth: Path) -> tuple[bool, bool, str | list[str]]:
-    tsv_status = bool((pth / "participants.tsv").exists())
-    json_status = bool((pth / "participants.json").exists())
+def describe_raw_dataset(dataset_pth: Path) -> dict:
+    """Describe a raw dataset of openneuro."""
+    dataset_name = dataset_pth.name
+
+    index = index_dataset(dataset_pth)
+
+    dataset = new_dataset(dataset_name)
+    dataset["nb_subjects"] = len(index["subjects"])
+    dataset["has_mri"] = index["has_mri"]
+
+    tsv_status, json_status, columns = has_participant_tsv(dataset_pth, index)
+    dataset["has_participant_tsv"] = tsv_status
+    dataset["has_participant_json"] = json_status
+    dataset["participant_columns"] = columns
+    dataset["has_phenotype_dir"] = index["has_phenotype_dir"]
+
+    for der in [
+        "fmriprep",
+        "freesurfer",
+        "mriqc",
+    ]:
+        for name in index["derivatives"]:
+            if der in name:
+                dataset[
+                    der
+                ] = f"{URL_OPENNEURO}{dataset_name}/tree/main/derivatives/{name}"
+
+    return dataset
+
+
+def has_participant_tsv(
+    pth: Path, index: dict | None = None
+) -> tuple[bool, bool, str | list[str]]:
+    if index is None:
+        index = index_dataset(pth, scan_subjects=False)
+    tsv_status = index["has_participant_tsv"]
+    json_status = index["has_participant_json"]
     columns = "n/a"
     if tsv_status:
         columns = list_participants_tsv_columns(pth / "participants.tsv")
@@ -154,7 +308,7 @@ def has_participant_tsv(pth: Path) -> tuple[bool, bool, str | list[str]]:
 
 
 def list_openneuro_derivatives(
-    datalad_superdataset: Path, datasets: dict[str, list]
+    datalad_superdataset: Path, datasets: dict[str, list], n_jobs: int = N_JOBS
 ) -> dict[str, list]:
     """Indexes content of dataset on openneuro derivatives.
 
@@ -168,38 +322,9 @@ def list_openneuro_derivatives(
 
     mriqc_datasets = sorted(list(openneuro_derivatives.glob("*mriqc")))
 
-    for dataset_pth in mriqc_datasets:
-        dataset_name = dataset_pth.name.replace("-mriqc", "")
-
-        dataset = new_dataset(dataset_name)
-
-        dataset["nb_subjects"] = get_nb_subjects(dataset_pth)
-        dataset["has_mri"] = True
-        dataset["mriqc"] = f"{URL_OPENNEURO_DERIVATIVES}{dataset_pth.name}"
-
-        tsv_status, json_status, columns = has_participant_tsv(
-            dataset_pth / "sourcedata" / "raw"
-        )
-        dataset["has_participant_tsv"] = tsv_status
-        dataset["has_participant_json"] = json_status
-        dataset["participant_columns"] = columns
-
-        dataset["has_phenotype_dir"] = (
-            dataset_pth / "sourcedata" / "raw" / "phenotype"
-        ).exists()
-
-        fmriprep_dataset = Path(str(dataset_pth).replace("mriqc", "fmriprep"))
-        if fmriprep_dataset.exists():
-            dataset[
-                "fmriprep"
-            ] = f"{URL_OPENNEURO_DERIVATIVES}{fmriprep_dataset.name}"
-
-        freesurfer_dataset = fmriprep_dataset / "sourcedata" / "freesurfer"
-        if freesurfer_dataset.exists():
-            dataset[
-                "freesurfer"
-            ] = f"{dataset['fmriprep']}/tree/main/sourcedata/freesurfer"
-
+    for dataset in map_datasets(
+        describe_mriqc_dataset, mriqc_datasets, n_jobs
+    ):
         for keys in datasets:
             datasets[keys].append(dataset[keys])
 
@@ -237,7 +362,49 @@ def list_openneuro_derivatives(
     return datasets
 
 
+def describe_mriqc_dataset(dataset_pth: Path) -> dict:
+    """Describe an mriqc dataset of openneuro-derivatives \
+    and its matching fmriprep dataset."""
+    dataset_name = dataset_pth.name.replace("-mriqc", "")
+
+    dataset = new_dataset(dataset_name)
+
+    dataset["nb_subjects"] = get_nb_subjects(dataset_pth)
+    dataset["has_mri"] = True
+    dataset["mriqc"] = f"{URL_OPENNEURO_DERIVATIVES}{dataset_pth.name}"
+
+    tsv_status, json_status, columns = has_participant_tsv(
+        dataset_pth / "sourcedata" / "raw"
+    )
+    dataset["has_participant_tsv"] = tsv_status
+    dataset["has_participant_json"] = json_status
+    dataset["participant_columns"] = columns
+
+    dataset["has_phenotype_dir"] = (
+        dataset_pth / "sourcedata" / "raw" / "phenotype"
+    ).exists()
+
+    fmriprep_dataset = Path(str(dataset_pth).replace("mriqc", "fmriprep"))
+    if fmriprep_dataset.exists():
+        dataset[
+            "fmriprep"
+        ] = f"{URL_OPENNEURO_DERIVATIVES}{fmriprep_dataset.name}"
+
+    freesurfer_dataset = fmriprep_dataset / "sourcedata" / "freesurfer"
+    if freesurfer_dataset.exists():
+        dataset[
+            "freesurfer"
+        ] = f"{dataset['fmriprep']}/tree/main/sourcedata/freesurfer"
+
+    return dataset
+
+
 def install_dataset(dataset_pth: Path, verbose: bool) -> None:
+    # datalad takes about half a second to import:
+    # only pay for it when datasets are actually installed
+    import datalad.api as dlapi
+    from rich import print
+
     dl_dataset = dlapi.Dataset(dataset_pth)
     if not dl_dataset.is_installed():
         if verbose:
@@ -248,8 +415,7 @@ def install_dataset(dataset_pth: Path, verbose: bool) -> None:
 
 
 def get_nb_subjects(pth: Path) -> int:
-    tmp = [v for v in pth.glob("sub-*") if v.is_dir()]
-    return len(tmp)
+    return len(index_dataset(pth, scan_subjects=False)["subjects"])
 
 
 if __name__ == "__main__":
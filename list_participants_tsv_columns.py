@@ -1,5 +1,8 @@
 """List all columns in participants.tsv files in openneuro datasets.
 
+View over scan_participants, which reads each participants.tsv once
+to save both the columns and the levels outputs.
+
 Tries to identify columns:
 - that are all dates or timestamps
 - controlled terms
@@ -13,82 +16,24 @@ This is saved in:
 
 Also saved:
 - unique_columns.tsv counts the number of for column name
+(as well as bulk_annotation_levels.tsv)
 """
 
 from pathlib import Path
 
 import pandas as pd
 
-from logger import bulk_annotation_logger
-from utils import (
-    exclude_datasets,
-    get_participants_dict,
-    init_output,
-    new_row_template,
-    output_dir,
-    read_csv_autodetect_date,
-    update_row_with_column_info,
-)
-
-LOG_LEVEL = "INFO"
-
-log = bulk_annotation_logger(LOG_LEVEL)
-
-
-def main():
-    datalad_superdataset = Path("/home/remi/datalad/datasets.datalad.org")
-    openneuro = datalad_superdataset / "openneuro"
-
-    datasets = pd.read_csv(output_dir() / "openneuro.tsv", sep="\t")
-
-    output = init_output()
-
-    for _, dataset in datasets.iterrows():
-        dataset_name = dataset["name"]
-
-        log.info(f"dataset '{dataset_name}'")
-
-        if exclude_datasets(dataset):
-            continue
-
-        participant_tsv = openneuro / dataset_name / "participants.tsv"
-        try:
-            participants = read_csv_autodetect_date(participant_tsv, sep="\t")
-        except pd.errors.ParserError:
-            log.warning(f"Could not parse: {participant_tsv}")
-            continue
-
-        participants_dict = get_participants_dict(dataset, openneuro)
-
-        log.debug(
-            f"dataset {dataset_name} has columns: {participants.columns.values}"
-        )
-
-        row_template = new_row_template(
-            dataset_name, nb_rows=len(participants), include_levels=False
-        )
-
-        for column in participants.columns:
-            this_row = row_template.copy()
+import scan_participants
+from scan_participants import N_JOBS, USE_CACHE
 
-            this_row = update_row_with_column_info(
-                this_row, column, participants, participants_dict
-            )
 
-            for key in output.keys():
-                output[key].append(this_row[key])
+def main(n_jobs: int = N_JOBS, use_cache: bool = USE_CACHE):
+    scan_participants.main(n_jobs, use_cache)
 
-    output = pd.DataFrame.from_dict(output)
-    output_filename = output_dir() / "bulk_annotation_columns.tsv"
-    output.to_csv(
-        output_filename,
-        index=False,
-        sep="\t",
-    )
 
-    output.column = output.column.str.lower()
-    count = output.column.value_counts()
-    count.to_csv(output_dir() / "unique_columns.tsv", sep="\t")
+def list_dataset_columns(dataset: pd.Series, src_pth: Path) -> dict[str, list]:
+    """List the columns of the participants.tsv of one dataset."""
+    return scan_participants.scan_dataset(dataset, src_pth)["columns"]
 
 
 if __name__ == "__main__":
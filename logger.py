@@ -1,16 +1,181 @@
+"""Logger of the bulk annotation scripts.
+
+Messages are rendered according to LOG_FORMAT
+(or the BULK_ANNOTATION_LOG_FORMAT environment variable):
+- "rich": with rich (colors, time, source line),
+- "plain": one line of text per message,
+- "json": one JSON object per line,
+- "auto": "rich" when logging to a terminal, "plain" otherwise
+  (output redirected to a file...).
+
+Messages are written to stderr.
+To keep the scan loops fast:
+- messages should be logged with %-style arguments
+  (``log.debug("column '%s'", column)``) so that they are only formatted
+  if their level is enabled,
+- records are passed through a queue and rendered in a background thread,
+- DEBUG and INFO messages logged once per column or level
+  with ``extra=RATE_LIMITED`` are limited to RATE_LIMIT per RATE_PERIOD seconds
+  for each template, the number of messages dropped is added
+  to the next one let through.
+"""
+
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = os.environ.get("BULK_ANNOTATION_LOG_FORMAT", "auto")
+
+# maximum number of DEBUG / INFO messages with the same template
+# logged every RATE_PERIOD seconds
+RATE_LIMIT = 20
+RATE_PERIOD = 1.0
+
+# ``extra`` of the messages to rate-limit
+RATE_LIMITED = {"rate_limited": True}
+
+LOGGER_NAME = "rich"
+
+_listener = {"listener": None}
+
+
+class RateLimitFilter(logging.Filter):
+    """Limit the number of rate-limited records with the same template.
+
+    Only records below WARNING logged with ``extra=RATE_LIMITED`` are limited.
+    """
+
+    def __init__(
+        self, rate_limit: int = RATE_LIMIT, rate_period: float = RATE_PERIOD
+    ):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        # (level, template) -> [start of the period, count, suppressed]
+        self.counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Return False if the record is dropped."""
+        if record.levelno >= logging.WARNING or not getattr(
+            record, "rate_limited", False
+        ):
+            return True
+
+        key = (record.levelno, record.msg)
+        now = time.monotonic()
+        count = self.counts.get(key)
+        if count is None or now - count[0] >= self.rate_period:
+            suppressed = count[2] if count is not None else 0
+            self.counts[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = (
+                    f"{record.getMessage()} "
+                    f"({suppressed} similar messages suppressed)"
+                )
+                record.args = None
+            return True
+
+        if count[1] < self.rate_limit:
+            count[1] += 1
+            return True
 
-from rich.logging import RichHandler
+        count[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON lines."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Return the record as a JSON object on one line."""
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """Queue handler that renders records directly in forked processes, \
+    as the listener thread only runs in the process that created it."""
+
+    def __init__(self, queue_: queue.Queue, handler: logging.Handler):
+        super().__init__(queue_)
+        self.handler = handler
+        self.pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments in the message before the record is queued.
+
+        Unlike QueueHandler.prepare, the exception is kept as is
+        so that the handler can render it (rich traceback, JSON field...).
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Queue the record (render it directly in forked processes)."""
+        if os.getpid() == self.pid:
+            super().enqueue(record)
+        else:
+            self.handler.handle(record)
+
+
+def get_handler(log_format: str = LOG_FORMAT) -> logging.Handler:
+    """Return the handler rendering messages in ``log_format``."""
+    if log_format == "auto":
+        log_format = "rich" if sys.stderr.isatty() else "plain"
+
+    if log_format == "rich":
+        from rich.console import Console
+        from rich.logging import RichHandler
+
+        handler = RichHandler(console=Console(stderr=True))
+        handler.setFormatter(logging.Formatter("%(message)s", "[%X]"))
+    elif log_format == "plain":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)-8s %(message)s")
+        )
+    elif log_format == "json":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+    else:
+        raise ValueError(
+            f"unknown log format '{log_format}': "
+            "should be one of 'auto', 'rich', 'plain' or 'json'"
+        )
+    return handler
 
 
 def bulk_annotation_logger(log_level: str = "INFO"):
-    FORMAT = "%(message)s"
+    """Return the logger of the bulk annotation scripts.
+
+    Logging is only configured on the first call.
+    """
+    if _listener["listener"] is None:
+        handler = get_handler()
+        queue_handler = _QueueHandler(queue.SimpleQueue(), handler)
+        queue_handler.addFilter(RateLimitFilter())
+
+        logging.basicConfig(level=log_level, handlers=[queue_handler])
 
-    logging.basicConfig(
-        level=log_level,
-        format=FORMAT,
-        datefmt="[%X]",
-        handlers=[RichHandler()],
-    )
+        listener = QueueListener(queue_handler.queue, handler)
+        listener.start()
+        atexit.register(listener.stop)
+        _listener["listener"] = listener
 
-    return logging.getLogger("rich")
+    return logging.getLogger(LOGGER_NAME)
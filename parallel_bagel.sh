@@ -2,14 +2,22 @@
 
 ldout=outputs/openneuro-jsonld/
 
+pending=()
 for ds in inputs/openneuro-jsonld/*; do
     ds_id=$(basename $ds)
     if [ ! -e ${ldout}/${ds_id}.jsonld ]; then
-        # Get human-readable dataset name or "None"
-        ds_name=$(python extract_bids_dataset_name.py --ds $ds)
-
-        echo ./run_bagel_cli.sh $ds_id \"$ds_name\"
+        pending+=(--ds "$ds")
     fi
+done
+
+if [ ${#pending[@]} -eq 0 ]; then
+    exit 0
+fi
+
+# Get human-readable dataset names (or "None") of all datasets in one go
+python extract_bids_dataset_name.py --tsv "${pending[@]}" | tail -n +2 |
+while IFS=$'\t' read -r ds_id ds_name; do
+    echo ./run_bagel_cli.sh $ds_id \"$ds_name\"
 
 # Now run this in parallel with -j 8 jobs
 # and have stderr and output both displayed and appended to a file
@@ -1,32 +1,43 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from itertools import repeat
 from pathlib import Path
 import json
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple
 
-import jsonschema
+import numpy as np
 import pandas as pd
 
+import instrumentation
+from instrumentation import stage, timed
+from utils import LEVELS_DTYPES, read_table
+
+if TYPE_CHECKING:
+    import jsonschema
+
 
 MYPATH = Path(__file__).parent
-with (MYPATH / "bagel_dictionary_schema.json").open("r") as f:
-    SCHEMA = json.load(f)
 
+# number of worker processes used to build the data dictionaries
+N_JOBS = 1
 
-def is_discrete(df: pd.DataFrame) -> bool:
-    """True if each row in dataframe describes a discrete value in a column."""
-    return not df.is_row.all()
 
+def is_discrete(levels: list) -> bool:
+    """True if the column has rows describing its discrete values."""
+    return len(levels) > 0
 
-def is_dropped(df: pd.DataFrame) -> bool:
+
+def is_dropped(col_row: dict) -> bool:
     """True if the column has been dropped, False otherwise"""
-    return (get_col_rows(df)["Decision"] == "drop").item()
+    return col_row["Decision"] == "drop"
 
 
-def is_identifying(df: pd.DataFrame) -> bool:
-    return get_col_rows(df)["controlled_term"].item() == "nb:ParticipantID"
+def is_identifying(col_row: dict) -> bool:
+    return col_row["controlled_term"] == "nb:ParticipantID"
 
 
-def is_tool(df: pd.DataFrame) -> bool:
-    return "cogatlas:" in str(get_col_rows(df)["isPartOf"].item())
+def is_tool(col_row: dict) -> bool:
+    return "cogatlas:" in str(col_row["isPartOf"])
 
 
 def get_ds_path(dataset: str) -> Path:
@@ -49,7 +60,11 @@ def fetch_data_dictionary(dataset: str) -> dict:
 
 def get_transform_heuristic(df: pd.DataFrame) -> Tuple[str]:
     """Returns Neurobagel transformation term and short label from parsed type"""
-    col_type = get_col_rows(df)["type"].item()
+    return get_transform(get_col_row(df)["type"])
+
+
+def get_transform(col_type: str) -> Tuple[str]:
+    """Returns Neurobagel transformation term and short label for a column type"""
     if col_type == "float64":
         return ("nb:float", "float data")
     if col_type == "int64":
@@ -63,11 +78,31 @@ def get_transform_heuristic(df: pd.DataFrame) -> Tuple[str]:
 
 
 def get_col_rows(df: pd.DataFrame) -> pd.DataFrame:
-    return df.query("is_row == True")
+    return df[as_mask(df["is_row"] == True)]
 
 
 def get_level_rows(df: pd.DataFrame) -> pd.DataFrame:
-    return df.query("is_row == False")
+    return df[as_mask(df["is_row"] == False)]
+
+
+def as_mask(mask: pd.Series) -> np.ndarray:
+    """Return a boolean mask where missing values are False."""
+    return mask.to_numpy(dtype=bool, na_value=False)
+
+
+def get_col_row(df: pd.DataFrame) -> dict:
+    """Return the only row describing the column of a dataframe."""
+    (col_row,) = to_records(get_col_rows(df))
+    return col_row
+
+
+def to_records(df: pd.DataFrame) -> list[dict]:
+    """Return the rows of a dataframe as dicts.
+
+    Faster than DataFrame.to_dict("records") for categorical columns.
+    """
+    values = zip(*(df[column].tolist() for column in df.columns))
+    return [dict(zip(df.columns, row)) for row in values]
 
 
 def describe_isabout(term: str) -> dict:
@@ -79,10 +114,10 @@ def describe_isabout(term: str) -> dict:
     }
     
     
-def describe_identified(df: pd.DataFrame) -> dict:
+def describe_identified(col_row: dict) -> dict:
     return {
         "Annotations": {
-        **describe_isabout(get_col_rows(df)["controlled_term"].item()),
+        **describe_isabout(col_row["controlled_term"]),
         "Identifies": "participant"
         }
     }
@@ -93,49 +128,54 @@ def describe_level(term: str) -> dict:
 
 
 def describe_continuous(df: pd.DataFrame) -> dict:
-    t_url, t_label = get_transform_heuristic(df)
+    return describe_continuous_column(get_col_row(df))
+
+
+def describe_continuous_column(col_row: dict) -> dict:
+    t_url, t_label = get_transform(col_row["type"])
     if not t_url:
-        print(df["dataset"].item(),  "has no age")
+        print(col_row["dataset"], "has no age")
         return {}
-    
+
     return {
         "Annotations": {
-            **describe_isabout(get_col_rows(df)["controlled_term"].item()),
+            **describe_isabout(col_row["controlled_term"]),
             "Transformation": {"TermURL": t_url, "Label": t_label},
             "MissingValues": ["", "n/a", " "]
         }
     }
 
 
-def get_missing(df: pd.DataFrame) -> list:
-    missing = [row["value"] for rid, row in df.iterrows() if row["controlled_term"] == "nb:MissingValue"]
+def get_missing(col_row: dict, levels: list) -> list:
+    missing = [value for value, term in [(col_row["value"], col_row["controlled_term"]), *levels] if term == "nb:MissingValue"]
     if "nan" in missing:
         missing.extend(["n/a", "", " "])
-    return list(set(missing))
+    # sorted so that the data dictionaries do not change from run to run
+    return sorted(set(missing))
 
 
-def describe_discrete(df: pd.DataFrame) -> dict:
+def describe_discrete(col_row: dict, levels: list) -> dict:
     col_annotation = {
         "Annotations": {
-            **describe_isabout(get_col_rows(df)["controlled_term"].item()),
+            **describe_isabout(col_row["controlled_term"]),
             "Levels": {
-                row.value: describe_level(row.controlled_term)
-                for _, row in get_level_rows(df).iterrows() if not row["controlled_term"] == "nb:MissingValue"
+                value: describe_level(term)
+                for value, term in levels if not term == "nb:MissingValue"
             },
         }
     }
-    if missing := get_missing(df):
+    if missing := get_missing(col_row, levels):
         col_annotation["Annotations"]["MissingValues"] = missing
 
     return col_annotation
 
 
-def describe_tool(df: pd.DataFrame) -> dict:
+def describe_tool(col_row: dict) -> dict:
     return {
         "Annotations": {
-            **describe_isabout(get_col_rows(df)["controlled_term"].item()),
+            **describe_isabout(col_row["controlled_term"]),
             "IsPartOf": {
-                "TermURL": get_col_rows(df)["isPartOf"].item(),
+                "TermURL": col_row["isPartOf"],
                 "Label": "",
             },
         }
@@ -157,64 +197,167 @@ def add_description(data_dict: dict) -> dict:
     return data_dict
 
 
+@cache
+def get_validator() -> "jsonschema.protocols.Validator":
+    """Returns the validator of Neurobagel data dictionaries, compiled on first use"""
+    import jsonschema
+
+    with (MYPATH / "bagel_dictionary_schema.json").open("r") as f:
+        schema = json.load(f)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
 def is_valid_dict(data_dict: dict) -> bool:
     """Returns True for valid Neurobagel data dictionary"""
-    try:
-        jsonschema.validate(data_dict, schema=SCHEMA)
-        return True
-    except jsonschema.ValidationError:
-        return False
+    return get_validator().is_valid(data_dict)
 
 
-def write_data_dict(data_dict: dict, path: Path, name: str) -> None:
-    path.mkdir(exist_ok=True)
-    with (path / f"{name}.json").open("w") as f:
-        json.dump(data_dict, f, indent=2)
+def list_validation_errors(data_dict: dict) -> list[dict[str, str]]:
+    """Returns every problem of a data dictionary with its JSON path"""
+    errors = sorted(get_validator().iter_errors(data_dict), key=lambda error: error.json_path)
+    return [{"path": error.json_path, "message": error.message} for error in errors]
 
 
-def process_dict(ds_df: pd.DataFrame, user_dict: dict) -> dict:
+def write_data_dict(data_dict: dict, path: Path, name: str) -> bool:
     """
-    Take an existing data dictionary (can be empty) and
-    add what we have to it so that it gets more detailed.
+    Write the data dictionary atomically
+    unless the file already exists with the same content.
+
+    Returns True if the file was written.
+    """
+    path.mkdir(exist_ok=True)
+    output_file = path / f"{name}.json"
+    content = json.dumps(data_dict, indent=2)
+    if output_file.is_file() and output_file.read_text() == content:
+        return False
+
+    tmp_file = output_file.with_suffix(".json.tmp")
+    tmp_file.write_text(content)
+    tmp_file.replace(output_file)
+    return True
+
+
+@timed
+def split_annotations(annotated: pd.DataFrame) -> dict[str, tuple[dict, dict]]:
+    """Split the annotations of all datasets in one pass.
+
+    Returns for each dataset:
+    - the row describing each column, as a dict
+    - the (value, controlled_term) of the levels of each column
     """
-    for col, col_df in ds_df.groupby("column"):
-        if is_dropped(col_df):
+    datasets = {}
+    for col_row in to_records(get_col_rows(annotated)):
+        col_rows, _ = datasets.setdefault(col_row["dataset"], ({}, {}))
+        if col_row["column"] in col_rows:
+            raise ValueError(
+                f"column {col_row['column']} of {col_row['dataset']} "
+                "is described by more than one row"
+            )
+        col_rows[col_row["column"]] = col_row
+
+    level_rows = get_level_rows(annotated)
+    for dataset, column, value, term in zip(
+        level_rows["dataset"],
+        level_rows["column"],
+        level_rows["value"],
+        level_rows["controlled_term"],
+    ):
+        col_rows, levels = datasets.get(dataset, ({}, {}))
+        if column not in col_rows:
+            raise ValueError(
+                f"column {column} of {dataset} has no row with is_row == True"
+            )
+        levels.setdefault(column, []).append((value, term))
+
+    return datasets
+
+
+def annotate_dict(col_rows: dict, levels: dict, user_dict: dict) -> dict:
+    """Add the annotations of the columns of a dataset to its data dictionary."""
+    for col in sorted(col_rows):
+        col_row = col_rows[col]
+        col_levels = levels.get(col, [])
+        if is_dropped(col_row):
             continue
-        if is_identifying(col_df):
-            user_dict.setdefault(col, {}).update(**describe_identified(col_df))
-        elif is_tool(col_df):
-            user_dict.setdefault(col, {}).update(**describe_tool(col_df))
-        elif is_discrete(col_df):
-            user_dict.setdefault(col, {}).update(**describe_discrete(col_df))
+        if is_identifying(col_row):
+            user_dict.setdefault(col, {}).update(**describe_identified(col_row))
+        elif is_tool(col_row):
+            user_dict.setdefault(col, {}).update(**describe_tool(col_row))
+        elif is_discrete(col_levels):
+            user_dict.setdefault(col, {}).update(**describe_discrete(col_row, col_levels))
         else:
-            user_dict.setdefault(col, {}).update(**describe_continuous(col_df))
+            user_dict.setdefault(col, {}).update(**describe_continuous_column(col_row))
 
     user_dict = add_description(data_dict=user_dict)
 
     return user_dict
 
 
+def process_dict(ds_df: pd.DataFrame, user_dict: dict) -> dict:
+    """
+    Take an existing data dictionary (can be empty) and
+    add what we have to it so that it gets more detailed.
+    """
+    col_rows, levels = {}, {}
+    for ds_col_rows, ds_levels in split_annotations(ds_df).values():
+        col_rows.update(ds_col_rows)
+        levels.update(ds_levels)
+
+    return annotate_dict(col_rows, levels, user_dict)
+
+
+@timed
 def load_annotations(annotated_path: Path) -> pd.DataFrame:
-    return pd.read_csv(annotated_path, sep="\t", dtype={'isPartOf': str, 'value': str, 'type': str}, keep_default_na=False)
+    """Load the annotated levels from a TSV or a Parquet file."""
+    return read_table(annotated_path, dtypes=LEVELS_DTYPES, dtype={'isPartOf': str, 'value': str, 'type': str}, keep_default_na=False)
 
 
-def main(annotated_path: Path = MYPATH / "outputs/annotated_levels.tsv", output_path: Path = MYPATH / "outputs/data_dictionaries/"):
-    annotated = load_annotations(annotated_path)
+def build_data_dict(dataset: str, annotations: tuple[dict, dict], output_path: Path) -> bool:
+    """Annotate, validate and write the data dictionary of a dataset.
 
-    for dataset, ds_df in annotated.groupby("dataset"):
+    Returns True if the data dictionary is valid.
+    """
+    with stage('build_data_dict', dataset=dataset, columns=len(annotations[0])):
         data_dict = fetch_data_dictionary(dataset=dataset)
 
-        data_dict = process_dict(ds_df, data_dict)
+        data_dict = annotate_dict(*annotations, data_dict)
 
-        if not is_valid_dict(data_dict):
-            # TODO: make smarter choices about logging and warnings
-            # print("Uhoh, this is not a valid dict", dataset)
-            pass
         write_data_dict(
             data_dict, output_path, name=dataset
         )
+        return is_valid_dict(data_dict)
+
+
+def main(annotated_path: Path = MYPATH / "outputs/annotated_levels.tsv", output_path: Path = MYPATH / "outputs/data_dictionaries/", n_jobs: int = N_JOBS) -> list[str]:
+    """Write the data dictionaries of all annotated datasets.
+
+    Returns the datasets whose data dictionary is not valid.
+    """
+    instrumentation.reset()
+
+    annotated = load_annotations(annotated_path)
+
+    datasets = split_annotations(annotated)
+    names = sorted(datasets)
+    annotations = [datasets[dataset] for dataset in names]
+
+    output_path.mkdir(exist_ok=True)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            valid = list(executor.map(build_data_dict, names, annotations, repeat(output_path), chunksize=16))
+    else:
+        valid = list(map(build_data_dict, names, annotations, repeat(output_path)))
+
+    invalid = [dataset for dataset, is_valid in zip(names, valid) if not is_valid]
+    if invalid:
+        print(f"{len(invalid)} / {len(names)} data dictionaries are not valid:", *invalid)
     print("Tada!")
 
+    instrumentation.report()
+    return invalid
+
 
 if __name__ == "__main__":
     main()
@@ -8,27 +8,31 @@ ds_name="$2"
 ds_portal=https://github.com/OpenNeuroDatasets-JSONLD/${ds}.git
 workdir=`realpath ${ldin}/$ds`
 container_dir=/${ds}
+# the dataset is not modified:
+# the patched data dictionary and the bagel outputs are saved in ldwork
+ldwork=${ldout}/work/${ds}
+container_work=/work
 out=(${ldout}/${ds}.jsonld)
 
 if [ "$ds_name" == "None" ]; then
     ds_name=$ds
 fi
 
-if [ ! -e ${ldout} ]; then
-    mkdir -p ${ldout}
+if [ ! -e ${ldwork} ]; then
+    mkdir -p ${ldwork}
 fi
+ldwork=`realpath ${ldwork}`
 
 echo $ds "$ds_name"
 if [ ! -e ${out} ]; then
+    rm -f ${ldwork}/pheno.jsonld ${ldwork}/pheno_bids.jsonld
+
     echo Checking data dictionary for descriptions!
-    python3 add_description.py ${workdir}/participants.json
+    python3 add_description.py ${workdir}/participants.json --output ${ldwork}/participants.json
 
-    echo bagel pheno --pheno ${workdir}/participants.tsv --dictionary ${workdir}/participants.json --output ${workdir}/pheno.jsonld --name "$ds_name" --portal $ds_portal
-    docker run --rm -v ${workdir}:${container_dir} neurobagel/bagelcli:latest pheno --pheno ${container_dir}/participants.tsv --dictionary ${container_dir}/participants.json --output ${container_dir}/pheno.jsonld --name "$ds_name" --portal $ds_portal
-    docker run --rm -v ${workdir}:${container_dir} neurobagel/bagelcli:latest bids --jsonld-path ${container_dir}/pheno.jsonld --bids-dir ${container_dir} --output ${container_dir}/pheno_bids.jsonld
+    echo bagel pheno --pheno ${workdir}/participants.tsv --dictionary ${ldwork}/participants.json --output ${ldwork}/pheno.jsonld --name "$ds_name" --portal $ds_portal
+    docker run --rm -v ${workdir}:${container_dir} -v ${ldwork}:${container_work} neurobagel/bagelcli:latest pheno --pheno ${container_dir}/participants.tsv --dictionary ${container_work}/participants.json --output ${container_work}/pheno.jsonld --name "$ds_name" --portal $ds_portal
+    docker run --rm -v ${workdir}:${container_dir} -v ${ldwork}:${container_work} neurobagel/bagelcli:latest bids --jsonld-path ${container_work}/pheno.jsonld --bids-dir ${container_dir} --output ${container_work}/pheno_bids.jsonld
 
-    echo Resetting dataset to HEAD
-    git -C ${workdir} checkout HEAD -- participants.json
-    
-    cp ${workdir}/pheno_bids.jsonld ${out}
+    cp ${ldwork}/pheno_bids.jsonld ${out}
 fi
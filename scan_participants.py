@@ -0,0 +1,487 @@
+"""Scan the participants.tsv files of the openneuro datasets.
+
+Each participants.tsv (and participants.json) is read once
+to list both its columns and their levels.
+
+Tries to identify for each column:
+- from participants.json
+  - description
+  - unit
+  - term_url
+- nb_levels it contains
+- the number of occurrences of each of its levels (nb_occurrences)
+- its type from one of the following:
+    - "datetime64[ns]",
+    - "float64",
+    - "int64",
+    - "yes_no",
+    - "bool",
+    - "int",
+    - "float",
+    - "nb:range",
+    - "nb:bounded",
+    - "nb:euro",
+    - "ratio",
+- tries to give it a controlled term: nb:Age, nb:ParticipantID, nb:Sex
+- checks if the levels of this columns should be indexed or it can be skipped
+  see heuristics.skip_column for details
+- if the column was not skipped then its levels are listed
+  by first checking the ones mentioned in the participants.json if it exists
+  then looking up any levels that was not described in there.
+
+
+Output is saved in:
+- bulk_annotation_columns.tsv: the columns
+  (only participant_id columns get a controlled term)
+- bulk_annotation_levels.tsv: the columns and their levels
+- unique_columns.tsv: counts the number of datasets for column name
+
+Some sanity checks are performed on the output files (no duplicate for a given dataset...)
+and the problems found are saved in:
+- bulk_annotation_levels_checks.tsv
+
+"""
+
+from collections import Counter, deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import instrumentation
+from cache import CODE_FILES, cache_dir, get_rows
+from heuristics import (
+    get_levels_from_data_dict,
+    is_age,
+    is_participant_id,
+    is_sex,
+    skip_column,
+)
+from instrumentation import COLUMN_STAGE, DATASET_STAGE, stage, timed
+from logger import RATE_LIMITED, bulk_annotation_logger
+from utils import (
+    LEVELS_DTYPES,
+    TableWriter,
+    count_levels,
+    exclude_datasets,
+    get_participants_dict,
+    init_output,
+    load_table,
+    new_row_template,
+    output_dir,
+    read_csv_autodetect_date,
+    read_table,
+    update_row_with_column_info,
+)
+
+LOG_LEVEL = "INFO"
+
+# set to True to do some debugging on a subset of datasets
+DRY_RUN = False
+
+# number of worker processes used to scan the datasets:
+# datasets are scanned serially when set to 1
+N_JOBS = 1
+
+# maximum number of datasets submitted to the pool per worker process:
+# the outputs of the datasets scanned ahead of the one awaited
+# are kept in memory until they are yielded
+PENDING_PER_JOB = 2
+
+# set to False to rescan all datasets instead of reusing
+# the rows cached for the datasets that did not change since the last run
+USE_CACHE = True
+
+log = bulk_annotation_logger(LOG_LEVEL)
+
+
+def main(n_jobs: int = N_JOBS, use_cache: bool = USE_CACHE):
+    datalad_superdataset = Path("/home/remi/datalad/datasets.datalad.org")
+    openneuro = datalad_superdataset / "openneuro"
+
+    datasets = load_table("openneuro")
+    if DRY_RUN:
+        datasets = datasets.head(11)
+
+    cache = cache_dir() / "scan" if use_cache else None
+
+    instrumentation.reset()
+
+    with TableWriter(
+        "bulk_annotation_columns", list(init_output()), LEVELS_DTYPES
+    ) as columns_writer, TableWriter(
+        "bulk_annotation_levels",
+        list(init_output(include_levels=True)),
+        LEVELS_DTYPES,
+    ) as levels_writer:
+        for dataset_output in scan_datasets(
+            [dataset for _, dataset in datasets.iterrows()],
+            openneuro,
+            n_jobs,
+            cache,
+        ):
+            columns_writer.write(dataset_output["columns"])
+            levels_writer.write(dataset_output["levels"])
+
+    count_unique_columns(columns_writer.tsv)
+
+    report = sanity_checks(levels_writer.path)
+    report.to_csv(
+        output_dir() / "bulk_annotation_levels_checks.tsv",
+        index=False,
+        sep="\t",
+    )
+
+    instrumentation.report()
+
+
+def count_unique_columns(columns_tsv: Path) -> None:
+    """Save the number of occurrences of each column name \
+    in unique_columns.tsv."""
+    # only the column names are read back from the table
+    output = pd.read_csv(
+        columns_tsv,
+        sep="\t",
+        usecols=["column"],
+        dtype=str,
+        keep_default_na=False,
+    )
+    output.column = output.column.str.lower()
+    count = output.column.value_counts()
+    count.to_csv(output_dir() / "unique_columns.tsv", sep="\t")
+
+
+def scan_datasets(
+    datasets: list[pd.Series],
+    src_pth: Path,
+    n_jobs: int = 1,
+    cache: Path | None = None,
+) -> Iterator[dict[str, dict[str, list]]]:
+    """Yield the output rows of each dataset in the order of ``datasets``.
+
+    See scan_dataset for the format of the rows.
+
+    If ``n_jobs`` is greater than 1, datasets are processed
+    in a pool of ``n_jobs`` worker processes,
+    with at most ``PENDING_PER_JOB * n_jobs`` datasets submitted at a time.
+
+    If ``cache`` is a directory, rows of datasets that did not change
+    since they were cached in it are not listed again.
+    """
+    if n_jobs <= 1:
+        for dataset in datasets:
+            yield get_dataset_outputs(dataset, src_pth, cache)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for dataset in datasets:
+            if len(pending) >= PENDING_PER_JOB * n_jobs:
+                yield pending.popleft().result()
+            pending.append(
+                executor.submit(get_dataset_outputs, dataset, src_pth, cache)
+            )
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_dataset_outputs(
+    dataset: pd.Series, src_pth: Path, cache: Path | None = None
+) -> dict[str, dict[str, list]]:
+    if cache is None:
+        return scan_dataset(dataset, src_pth)
+    return get_rows(
+        scan_dataset,
+        dataset,
+        src_pth,
+        cache,
+        code_files=[*CODE_FILES, Path(__file__)],
+    )
+
+
+def scan_dataset(
+    dataset: pd.Series, src_pth: Path
+) -> dict[str, dict[str, list]]:
+    """List the columns and levels of the participants.tsv of one dataset.
+
+    Returns the rows of the columns output (in the format of init_output)
+    and of the levels output (in the format of init_output(include_levels=True))
+    under the keys "columns" and "levels".
+    """
+    with stage(DATASET_STAGE, dataset=dataset["name"]) as info:
+        outputs = _scan_dataset(dataset, src_pth)
+        nb_rows = outputs["columns"]["nb_rows"]
+        info["rows"] = nb_rows[0] if nb_rows else 0
+        info["columns"] = len(nb_rows)
+    return outputs
+
+
+def _scan_dataset(
+    dataset: pd.Series, src_pth: Path
+) -> dict[str, dict[str, list]]:
+    columns = init_output()
+    output = init_output(include_levels=True)
+    outputs = {"columns": columns, "levels": output}
+
+    dataset_name = dataset["name"]
+
+    log.info("dataset '%s'", dataset_name)
+
+    if exclude_datasets(dataset):
+        return outputs
+
+    participant_tsv = src_pth / dataset_name / "participants.tsv"
+    try:
+        participants = read_csv_autodetect_date(participant_tsv, sep="\t")
+    except pd.errors.ParserError:
+        log.warning("Could not parse: %s", participant_tsv)
+        return outputs
+
+    participants_dict = get_participants_dict(dataset, src_pth)
+
+    log.debug(
+        "dataset %s has columns: %s", dataset_name, participants.columns.values
+    )
+
+    row_template = new_row_template(
+        dataset_name, nb_rows=len(participants), include_levels=True
+    )
+
+    for column in participants.columns:
+        with stage(
+            COLUMN_STAGE,
+            dataset=dataset_name,
+            column=column,
+            rows=len(participants),
+        ):
+            this_row = row_template.copy()
+
+            level_counts = count_levels(participants[column])
+
+            this_row = update_row_with_column_info(
+                this_row, column, participants, participants_dict, level_counts
+            )
+
+            for key in columns.keys():
+                columns[key].append(this_row[key])
+
+            if is_participant_id(participants, column):
+                this_row["controlled_term"] = "nb:ParticipantID"
+            elif is_age(this_row):
+                this_row["controlled_term"] = "nb:Age"
+            elif is_sex(column):
+                this_row["controlled_term"] = "nb:Sex"
+
+            for key in output.keys():
+                output[key].append(this_row[key])
+
+            if skip_column(this_row, participants_dict):
+                log.debug(
+                    "  column '%s': skipping column",
+                    column,
+                    extra=RATE_LIMITED,
+                )
+                continue
+
+            output = list_levels(
+                output,
+                participants,
+                participants_dict,
+                column,
+                row_template,
+                level_counts,
+            )
+
+    return outputs
+
+
+@timed
+def list_levels(
+    output: pd.DataFrame,
+    participants: pd.DataFrame,
+    participants_dict: dict,
+    column: str,
+    row_template: dict[str, str],
+    level_counts: pd.Series | None = None,
+) -> pd.DataFrame:
+    """Get levels from data dictionary first, then from the data itself, \
+    and appends them to the output dictionary.
+
+    Adds any undefined level not found in the data dictionary.
+
+    The number of occurrences of each level in the data
+    is taken from ``level_counts`` (computed if not passed).
+    """
+    if level_counts is None:
+        level_counts = count_levels(participants[column])
+    # levels are compared as strings
+    occurrences = Counter()
+    for level_, count in zip(level_counts.index.to_numpy(), level_counts):
+        occurrences[str(level_)] += int(count)
+
+    levels = get_levels_from_data_dict(participants_dict, column)
+    if levels:
+        output = append_levels(
+            output, levels, column, row_template, occurrences
+        )
+
+    defined_levels = set(levels.keys())
+    undefined_levels = set(occurrences) - defined_levels
+
+    if len(undefined_levels) == 0:
+        return output
+
+    if len(defined_levels):
+        log.info(
+            "  column '%s': defined levels: %s",
+            column,
+            set(levels),
+            extra=RATE_LIMITED,
+        )
+    log.info(
+        "  column '%s': undefined levels: %s",
+        column,
+        undefined_levels,
+        extra=RATE_LIMITED,
+    )
+
+    output = append_levels(
+        output, undefined_levels, column, row_template, occurrences
+    )
+
+    return output
+
+
+def append_levels(
+    output: pd.DataFrame,
+    levels: set | dict,
+    column: str,
+    row_template: dict[str, str],
+    occurrences: Counter | None = None,
+):
+    for level_ in sorted(levels):
+        log.debug(
+            "  column '%s': appending level '%s'",
+            column,
+            level_,
+            extra=RATE_LIMITED,
+        )
+
+        this_row = row_template.copy()
+        this_row["column"] = column
+        this_row["is_row"] = False
+        this_row["value"] = level_
+        if occurrences is not None:
+            this_row["nb_occurrences"] = occurrences[str(level_)]
+        if isinstance(levels, dict):
+            this_row["description"] = levels.get(level_, "n/a")
+        for key in this_row:
+            output[key].append(this_row[key])
+    return output
+
+
+def sanity_checks(file: Path) -> pd.DataFrame:
+    """Run checks on output file.
+
+    Checks:
+
+    Each dataset should have a nb:ParticipantID
+
+    - some columns of the oupput files should not have duplicated values
+    for a given dataset because:
+      - controlled_term (cannot have 2 nb:Age for one dataset)
+      - cannot be describing a column twice in a dataset
+      - no duplicated levels for a column in a dataset
+
+    Returns a report with one row (dataset, column, check, details)
+    for each problem found. Each problem is also logged as an error.
+    """
+    df = read_table(file)
+    df = df.astype({c: object for c in df.select_dtypes("category")})
+
+    columns = df[df.is_row == True]
+    levels = df[df.is_row == False]
+
+    report = init_report()
+
+    with_participant_id = set(
+        columns.dataset[columns.controlled_term == "nb:ParticipantID"]
+    )
+    for dataset in df.dataset.unique():
+        if dataset not in with_participant_id:
+            add_to_report(
+                report, dataset, "n/a", "no_participant_id", "no column"
+            )
+
+    for (dataset, controlled_term), group in duplicated(
+        columns, ["dataset", "controlled_term"]
+    ):
+        add_to_report(
+            report,
+            dataset,
+            ", ".join(group.column.astype(str)),
+            "duplicated_controlled_term",
+            f"{controlled_term} used {len(group)} times",
+        )
+
+    for (dataset, column), group in duplicated(columns, ["dataset", "column"]):
+        add_to_report(
+            report,
+            dataset,
+            column,
+            "duplicated_column",
+            f"described {len(group)} times",
+        )
+
+    for (dataset, column, value), group in duplicated(
+        levels, ["dataset", "column", "value"]
+    ):
+        add_to_report(
+            report,
+            dataset,
+            column,
+            "duplicated_level",
+            f"level '{value}' listed {len(group)} times",
+        )
+
+    report = pd.DataFrame.from_dict(report)
+    for _, row in report.iterrows():
+        log.error(
+            "dataset %s: %s (column: %s): %s",
+            row.dataset,
+            row.check,
+            row.column,
+            row.details,
+        )
+    return report
+
+
+def init_report() -> dict[str, list]:
+    return {"dataset": [], "column": [], "check": [], "details": []}
+
+
+def add_to_report(
+    report: dict[str, list],
+    dataset: str,
+    column: str,
+    check: str,
+    details: str,
+) -> None:
+    report["dataset"].append(dataset)
+    report["column"].append(column)
+    report["check"].append(check)
+    report["details"].append(details)
+
+
+def duplicated(df: pd.DataFrame, keys: list[str]):
+    """Group the rows whose values for ``keys`` are duplicated.
+
+    Missing values (like a "n/a" controlled term) are ignored.
+    """
+    mask = df.duplicated(keys, keep=False) & df[keys].notna().all(axis=1)
+    return df[mask].groupby(keys, sort=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,14 @@
+"""Replace the Cognitive Atlas assessment terms of the annotated data dictionaries with the terms of the new vocabulary.
+
+Assessments that have no term in the new vocabulary are dropped.
+
+Only the data dictionaries whose content changed are rewritten (atomically),
+and a report of the number of terms remapped and dropped in each file is printed.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from functools import partial
 from pathlib import Path
 import json
 
@@ -5,43 +16,96 @@ from tqdm import tqdm
 
 
 def replace_terms(dictionary, map_dict):
-    
+    updated_dict, _, _ = remap_terms(dictionary, map_dict)
+    return updated_dict
+
+
+def remap_terms(dictionary, map_dict):
+    """Replace the assessment terms of a data dictionary.
+
+    Terms that are already in the new vocabulary are kept as is,
+    so that remapping a data dictionary twice does not drop them.
+
+    Returns the updated dictionary and the number of terms remapped and dropped.
+    """
+    new_terms = set(map_dict.values())
+    nb_remapped = 0
+    nb_dropped = 0
+
     updated_dict = {}
     for key, value in dictionary.items():
         if "Annotations" in value and "IsPartOf" in value["Annotations"]:
             cogatlas_id = value["Annotations"]["IsPartOf"]["TermURL"]
             if cogatlas_id in map_dict:
                 value["Annotations"]["IsPartOf"]["TermURL"] = map_dict[cogatlas_id]
-                updated_dict[key] = value
-            else:
+                nb_remapped += 1
+            elif cogatlas_id not in new_terms:
                 value.pop("Annotations")
-                updated_dict[key] = value
-        else:
-            updated_dict[key] = value
-    return updated_dict
-        
+                nb_dropped += 1
+        updated_dict[key] = value
+    return updated_dict, nb_remapped, nb_dropped
+
+
+def process_dictionary(dictionary_f, my_map):
+    """Remap the terms of a data dictionary file.
 
+    The file is only rewritten if its content changed
+    (a different formatting of the same content is not a change).
+    """
+    with open(dictionary_f, 'r') as f:
+        dictionary = json.load(f)
+    # remap_terms updates the dictionary passed in place
+    updated_dict, nb_remapped, nb_dropped = remap_terms(deepcopy(dictionary), my_map)
 
-def parse_dictionaries(work_dir, map_file):
+    changed = updated_dict != dictionary
+    if changed:
+        tmp_file = dictionary_f.with_suffix(".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(updated_dict, f, indent=4)
+        tmp_file.replace(dictionary_f)
+
+    return {
+        "file": dictionary_f.name,
+        "remapped": nb_remapped,
+        "dropped": nb_dropped,
+        "changed": changed,
+    }
+
+
+def parse_dictionaries(work_dir, map_file, n_jobs=1):
+    """Remap the terms of all the data dictionaries in a directory.
+
+    Returns one report per dictionary (see process_dictionary).
+    """
     with open(map_file, 'r') as f:
         my_map = json.load(f)
-    
+
     work_path = Path(work_dir)
-    dictionary_files = list(work_path.glob("*.json"))
-    
+    dictionary_files = sorted(work_path.glob("*.json"))
+
     print(f"Found {len(dictionary_files)} dictionaries")
-    
-    for dictionary_f in tqdm(dictionary_files, desc="Processing dictionaries"):
-        with open(dictionary_f, 'r') as f:
-            dictionary = json.load(f)
-            
-        updated_dict = replace_terms(dictionary, my_map)
-        
-        with open(dictionary_f, 'w') as f:
-            json.dump(updated_dict, f, indent=4)
-    
+
+    process = partial(process_dictionary, my_map=my_map)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            reports = list(tqdm(executor.map(process, dictionary_files, chunksize=16), total=len(dictionary_files), desc="Processing dictionaries"))
+    else:
+        reports = [process(x) for x in tqdm(dictionary_files, desc="Processing dictionaries")]
+
+    for report in reports:
+        if report["remapped"] or report["dropped"]:
+            print(f"{report['file']}: {report['remapped']} remapped, {report['dropped']} dropped")
+    print(
+        f"{sum(x['changed'] for x in reports)} dictionaries changed: "
+        f"{sum(x['remapped'] for x in reports)} terms remapped, "
+        f"{sum(x['dropped'] for x in reports)} terms dropped"
+    )
+
+    return reports
+
 
 if __name__ == "__main__":
     MAP_FILE = "outputs/vocab_map.json"
     WORK_DIR = "openneuro-annotations"
-    parse_dictionaries(work_dir=WORK_DIR, map_file=MAP_FILE)
\ No newline at end of file
+    N_JOBS = 8
+    parse_dictionaries(work_dir=WORK_DIR, map_file=MAP_FILE, n_jobs=N_JOBS)
@@ -6,31 +6,42 @@ import pandas as pd
 
 
 def make_map(input_file, table_file, output_file):
-    
-    
-    my_map = {}
-    
+    """Save the mapping and return the labels of the dictionary that are not in the table."""
     with open(input_file, 'r') as f:
         dictionary = json.load(f)
-        
+
     table = pd.read_csv(table_file, sep="\t")
-        
-    for key, value in dictionary.items():
-        if "Annotations" in value and "IsPartOf" in value["Annotations"]:
-            snomed_id = value["Annotations"]["IsPartOf"]["TermURL"]
-        else:
-            continue
-        
-        # Look up the cogAtlas ID for the tool name and then map it to the new SNOMED ID
-        cogatlas_id = table[key].values[0]
-        my_map[cogatlas_id] = snomed_id
-        
+
+    # The table has one column per tool label and a single row with the cogAtlas IDs
+    label_to_cogatlas = table.iloc[0]
+
+    # New SNOMED ID of each tool in the dictionary
+    snomed_ids = pd.Series(
+        {
+            key: value["Annotations"]["IsPartOf"]["TermURL"]
+            for key, value in dictionary.items()
+            if "Annotations" in value and "IsPartOf" in value["Annotations"]
+        },
+        dtype=object,
+    )
+
+    # Look up the cogAtlas ID for all tool names at once and then map them to the new SNOMED IDs
+    cogatlas_ids = snomed_ids.index.map(label_to_cogatlas)
+    is_mapped = cogatlas_ids.notna()
+    my_map = dict(zip(cogatlas_ids[is_mapped], snomed_ids[is_mapped]))
+
+    unmapped = snomed_ids.index[~is_mapped].tolist()
+    if unmapped:
+        print(f"{len(unmapped)} labels are not in {table_file}: {unmapped}")
+
     with open(output_file, 'w') as f:
         json.dump(my_map, f, indent=4)
-    
+
+    return unmapped
+
 
 if __name__ == "__main__":
     DICTIONARY_FILE = "manual_files/assessments_data_dictionary.json"
-    TABLE_FILE= "outputs/assessments.tsv"
+    TABLE_FILE = "outputs/assessments.tsv"
     OUTPUT_FILE = "outputs/vocab_map.json"
     make_map(DICTIONARY_FILE, TABLE_FILE, OUTPUT_FILE)
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""Generate a synthetic corpus of BIDS-like datasets.
+
+Used to benchmark the annotation pipeline (see benchmark.py)
+without having to install the openneuro datasets.
+
+The corpus has the same layout as the openneuro superdataset::
+
+    {root}/openneuro/ds000001/dataset_description.json
+                              participants.tsv
+                              participants.json (for some datasets)
+                              sub-001/anat/
+                              ...
+
+Each participants.tsv has a participant_id column
+and columns of the kinds listed in COLUMN_KINDS
+(categorical, dates, european decimals, ranges, ratios...).
+
+The content of the corpus only depends on the parameters passed
+(including the seed of the random generator).
+"""
+
+import json
+import random
+import zlib
+from pathlib import Path
+
+import pandas as pd
+import typer
+
+# kinds of columns in the participants.tsv files:
+# columns are created by cycling through this list
+COLUMN_KINDS = [
+    "age",
+    "sex",
+    "categorical",
+    "date",
+    "euro",
+    "range",
+    "ratio",
+    "bounded",
+    "yes_no",
+    "float",
+]
+
+# proportion of missing values in each column
+MISSING_RATE = 0.05
+
+
+def generate_corpus(
+    root: Path,
+    nb_datasets: int = 100,
+    nb_rows: int = 100,
+    nb_columns: int = 10,
+    nb_levels: int = 5,
+    json_coverage: float = 0.5,
+    seed: int = 0,
+) -> Path:
+    """Generate a synthetic corpus and return the path of its 'openneuro' folder.
+
+    Parameters
+    ----------
+    nb_datasets :
+        number of datasets
+    nb_rows :
+        number of participants per dataset
+    nb_columns :
+        number of columns per participants.tsv (besides participant_id)
+    nb_levels :
+        number of levels of categorical columns
+    json_coverage :
+        proportion of the datasets that have a participants.json
+    seed :
+        seed of the random generator
+    """
+    rng = random.Random(seed)
+    openneuro = root / "openneuro"
+    for i in range(1, nb_datasets + 1):
+        generate_dataset(
+            openneuro / f"ds{i:06d}",
+            rng,
+            nb_rows=nb_rows,
+            nb_columns=nb_columns,
+            nb_levels=nb_levels,
+            with_json=rng.random() < json_coverage,
+        )
+    return openneuro
+
+
+def generate_dataset(
+    dataset_pth: Path,
+    rng: random.Random,
+    nb_rows: int,
+    nb_columns: int,
+    nb_levels: int,
+    with_json: bool,
+) -> None:
+    dataset_pth.mkdir(parents=True, exist_ok=True)
+
+    with open(dataset_pth / "dataset_description.json", "w") as f:
+        json.dump(
+            {"Name": f"synthetic {dataset_pth.name}", "BIDSVersion": "1.8.0"},
+            f,
+        )
+
+    subjects = [f"sub-{i:03d}" for i in range(1, nb_rows + 1)]
+    for subject in subjects[:2]:
+        (dataset_pth / subject / "anat").mkdir(parents=True, exist_ok=True)
+
+    participants = {"participant_id": subjects}
+    participants_dict = {"participant_id": {"Description": "participant ID"}}
+    for i in range(nb_columns):
+        kind = COLUMN_KINDS[i % len(COLUMN_KINDS)]
+        column = kind if i < len(COLUMN_KINDS) else f"{kind}_{i}"
+        participants[column] = generate_column(kind, rng, nb_rows, nb_levels)
+        participants_dict[column] = describe_column(
+            kind, column, participants[column]
+        )
+
+    pd.DataFrame(participants).to_csv(
+        dataset_pth / "participants.tsv", sep="\t", index=False
+    )
+    if with_json:
+        with open(dataset_pth / "participants.json", "w") as f:
+            json.dump(participants_dict, f, indent=2)
+
+
+def generate_column(
+    kind: str, rng: random.Random, nb_rows: int, nb_levels: int
+) -> list[str]:
+    """Return the values of a column of a given kind as strings."""
+    values = []
+    for _ in range(nb_rows):
+        if rng.random() < MISSING_RATE:
+            values.append("n/a")
+        elif kind == "age":
+            values.append(str(rng.randint(18, 90)))
+        elif kind == "sex":
+            values.append(rng.choice(["M", "F"]))
+        elif kind == "categorical":
+            values.append(f"level_{rng.randrange(nb_levels)}")
+        elif kind == "date":
+            values.append(
+                f"20{rng.randint(10, 23)}-{rng.randint(1, 12):02d}"
+                f"-{rng.randint(1, 28):02d}"
+            )
+        elif kind == "euro":
+            values.append(f"{rng.randint(0, 200)},{rng.randint(0, 99)}")
+        elif kind == "range":
+            start = rng.randint(10, 80)
+            values.append(f"{start}-{start + 5}")
+        elif kind == "ratio":
+            values.append(f"{rng.randint(0, 30)}/{rng.randint(1, 30)}")
+        elif kind == "bounded":
+            values.append(f"{rng.randint(60, 89)}+")
+        elif kind == "yes_no":
+            values.append(rng.choice(["yes", "no"]))
+        elif kind == "float":
+            values.append(f"{rng.uniform(0, 100):.2f}")
+        else:
+            raise ValueError(f"unknown column kind: '{kind}'")
+    return values
+
+
+def describe_column(kind: str, column: str, values: list[str]) -> dict:
+    """Return the description of a column in participants.json.
+
+    Only some of the levels of the discrete columns are described.
+    """
+    description = {"Description": f"synthetic {kind} column {column}"}
+    if kind in ["sex", "categorical", "yes_no"]:
+        levels = sorted(set(values) - {"n/a"})
+        description["Levels"] = {
+            level: f"description of {level}"
+            for level in levels[: len(levels) // 2 + 1]
+        }
+    return description
+
+
+def annotate_levels(levels: pd.DataFrame) -> pd.DataFrame:
+    """Return synthetic annotations of the levels output of a corpus.
+
+    Mimics the output of the annotation tool
+    (see process_annotation_to_dict.load_annotations) by annotating:
+    - the columns with a controlled term,
+    - the categorical columns as diagnosis, with a term for each level.
+
+    The other columns are not annotated.
+    """
+    annotated = levels.astype(
+        {c: object for c in levels.select_dtypes("category")}
+    )
+    annotated["is_row"] = annotated["is_row"].astype(bool)
+    annotated["value"] = annotated["value"].astype(str)
+
+    is_categorical = annotated["column"].str.startswith("categorical")
+    col_rows = annotated["is_row"]
+    annotated.loc[col_rows & is_categorical, "controlled_term"] = (
+        "nb:Diagnosis"
+    )
+
+    terms = annotated.loc[col_rows, ["dataset", "column", "controlled_term"]]
+    terms = terms[
+        terms["controlled_term"].isin(
+            ["nb:ParticipantID", "nb:Age", "nb:Sex", "nb:Diagnosis"]
+        )
+    ]
+    annotated = annotated.merge(
+        terms[["dataset", "column"]], on=["dataset", "column"]
+    )
+
+    level_rows = ~annotated["is_row"]
+    is_missing = annotated["value"].isin(["nan", "n/a", ""])
+    annotated.loc[level_rows, "controlled_term"] = [
+        (
+            "nb:MissingValue"
+            if missing
+            else f"snomed:{zlib.crc32(value.encode())}"
+        )
+        for value, missing in zip(
+            annotated.loc[level_rows, "value"], is_missing[level_rows]
+        )
+    ]
+    annotated.loc[~level_rows, "value"] = ""
+    annotated["description"] = ""
+    annotated["isPartOf"] = ""
+    annotated["Decision"] = "keep"
+
+    return annotated[
+        [
+            "dataset",
+            "column",
+            "type",
+            "value",
+            "is_row",
+            "description",
+            "controlled_term",
+            "isPartOf",
+            "Decision",
+        ]
+    ]
+
+
+def main(
+    root: Path = typer.Argument(..., help="Where to create the corpus"),
+    nb_datasets: int = typer.Option(100, help="Number of datasets"),
+    nb_rows: int = typer.Option(100, help="Number of participants"),
+    nb_columns: int = typer.Option(10, help="Number of columns"),
+    nb_levels: int = typer.Option(5, help="Levels of categorical columns"),
+    json_coverage: float = typer.Option(
+        0.5, help="Proportion of datasets with a participants.json"
+    ),
+    seed: int = typer.Option(0, help="Seed of the random generator"),
+):
+    """Generate a synthetic corpus of BIDS-like datasets."""
+    generate_corpus(
+        root,
+        nb_datasets=nb_datasets,
+        nb_rows=nb_rows,
+        nb_columns=nb_columns,
+        nb_levels=nb_levels,
+        json_coverage=json_coverage,
+        seed=seed,
+    )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,360 @@
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+import typer
+from typer.testing import CliRunner
+
+import bagel_batch
+from add_description import (
+    DESCRIPTION,
+    add_description,
+    main as add_description_main,
+    patch_dictionary,
+)
+from bagel_batch import DockerBagel, InProcessBagel, list_pending, run_batch
+from extract_bids_dataset_name import (
+    get_dataset_name,
+    main as extract_name_main,
+)
+
+
+def cli(main):
+    app = typer.Typer()
+    app.command()(main)
+    return app
+
+
+class FakeBagel:
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = fail
+
+    def run(self, args):
+        self.calls.append(args)
+        if args[0] == "pheno" and args[2].parent.name in self.fail:
+            raise RuntimeError("bagel pheno failed")
+        output = args[args.index("--output") + 1]
+        output.write_text(json.dumps({"args": [str(x) for x in args]}))
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    datasets = []
+    for name, data_dict in [
+        ("ds000001", {"age": {"Description": "age"}}),
+        ("ds000002", {"age": {"Units": "years"}}),
+    ]:
+        pth = tmp_path / "inputs" / name
+        pth.mkdir(parents=True)
+        (pth / "dataset_description.json").write_text(
+            json.dumps({"Name": f"name of {name}", "BIDSVersion": "1.8.0"})
+        )
+        (pth / "participants.tsv").write_text("participant_id\nsub-01\n")
+        (pth / "participants.json").write_text(json.dumps(data_dict))
+        datasets.append(pth)
+    return datasets
+
+
+def test_add_description():
+    data_dict = {"age": {"Units": "years"}, "sex": {"Description": "sex"}}
+
+    patched, have_written = add_description(data_dict)
+
+    assert have_written
+    assert patched["age"] == {"Units": "years", "Description": DESCRIPTION}
+    assert patched["sex"] == data_dict["sex"]
+    assert "Description" not in data_dict["age"]
+    assert add_description(patched) == (patched, False)
+
+
+def test_run_batch(tmp_path, datasets):
+    output_dir = tmp_path / "outputs"
+    runner = FakeBagel()
+
+    failed = run_batch(datasets, runner, output_dir, n_jobs=2)
+
+    assert failed == []
+    assert list_pending(datasets, output_dir) == []
+    assert len(runner.calls) == 4
+    pheno_calls = {
+        x[2].parent.name: x for x in runner.calls if x[0] == "pheno"
+    }
+    assert pheno_calls["ds000001"][4] == datasets[0] / "participants.json"
+    assert pheno_calls["ds000001"][8] == "name of ds000001"
+    # the patched data dictionary is not saved in the dataset
+    patched = pheno_calls["ds000002"][4]
+    assert patched == output_dir / "work" / "ds000002" / "participants.json"
+    assert json.loads(patched.read_text())["age"]["Description"] == DESCRIPTION
+    assert json.loads((datasets[1] / "participants.json").read_text()) == {
+        "age": {"Units": "years"}
+    }
+
+
+def test_run_batch_resumes(tmp_path, datasets):
+    output_dir = tmp_path / "outputs"
+
+    failed = run_batch(datasets, FakeBagel(fail=["ds000002"]), output_dir)
+
+    assert failed == ["ds000002"]
+    assert list_pending(datasets, output_dir) == [datasets[1]]
+
+    runner = FakeBagel()
+    run_batch(list_pending(datasets, output_dir), runner, output_dir)
+    assert {x[2].parent.name for x in runner.calls} == {"ds000002"}
+    assert list_pending(datasets, output_dir) == []
+
+
+def bagel_app(fail=()):
+    """Return a fake bagel CLI whose pheno command exits with code 1 \
+    for the datasets in ``fail``."""
+    app = typer.Typer()
+    called = []
+
+    @app.command()
+    def pheno(
+        pheno: str = typer.Option(...),
+        dictionary: str = typer.Option(...),
+        output: str = typer.Option(...),
+        name: str = typer.Option(...),
+        portal: str = typer.Option(...),
+    ):
+        called.append("pheno")
+        if any(dataset in pheno for dataset in fail):
+            raise typer.Exit(code=1)
+        with open(output, "w") as f:
+            json.dump({"name": name}, f)
+
+    @app.command()
+    def bids(
+        jsonld_path: str = typer.Option(...),
+        bids_dir: str = typer.Option(...),
+        output: str = typer.Option(...),
+    ):
+        called.append("bids")
+        with open(output, "w") as f:
+            json.dump({"bids_dir": bids_dir}, f)
+
+    return typer.main.get_command(app), called
+
+
+def test_in_process_bagel(tmp_path, datasets):
+    output_dir = tmp_path / "outputs"
+    app, called = bagel_app(fail=["ds000002"])
+
+    with InProcessBagel(app) as runner:
+        failed = run_batch(datasets, runner, output_dir)
+
+    assert failed == ["ds000002"]
+    # bids is not run after a failed pheno
+    assert called == ["pheno", "bids", "pheno"]
+    assert list_pending(datasets, output_dir) == [datasets[1]]
+
+
+def test_in_process_bagel_parallel(tmp_path, datasets):
+    output_dir = tmp_path / "outputs"
+    app, called = bagel_app(fail=["ds000002"])
+
+    with InProcessBagel(app) as runner:
+        failed = run_batch(datasets, runner, output_dir, n_jobs=2)
+
+    assert failed == ["ds000002"]
+    # the commands are run in the worker processes
+    assert called == []
+    assert list_pending(datasets, output_dir) == [datasets[1]]
+    assert json.loads((output_dir / "ds000001.jsonld").read_text()) == {
+        "bids_dir": str(datasets[0])
+    }
+
+
+def test_in_process_bagel_exit_code():
+    app, _ = bagel_app(fail=["ds000001"])
+    runner = InProcessBagel(app)
+    args = [
+        "--dictionary",
+        "a",
+        "--output",
+        "b",
+        "--name",
+        "c",
+        "--portal",
+        "d",
+    ]
+
+    with pytest.raises(RuntimeError, match="bagel pheno failed"):
+        runner.run(["pheno", "--pheno", "ds000001/participants.tsv", *args])
+
+
+def test_run_batch_missing_output(tmp_path, datasets):
+    class NoOutputBagel(FakeBagel):
+        def run(self, args):
+            self.calls.append(args)
+
+    output_dir = tmp_path / "outputs"
+
+    failed = run_batch(datasets, NoOutputBagel(), output_dir)
+
+    assert failed == ["ds000001", "ds000002"]
+    assert list_pending(datasets, output_dir) == datasets
+
+
+def test_docker_bagel(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_run(args, **kwargs):
+        calls.append(args)
+        returncode = 1 if args[-1] == "fail" else 0
+        return subprocess.CompletedProcess(
+            args, returncode, stdout="container-id\n", stderr="error"
+        )
+
+    monkeypatch.setattr(bagel_batch.subprocess, "run", fake_run)
+
+    with DockerBagel("bagel-image", root=tmp_path) as runner:
+        assert runner.container == "container-id"
+        runner.run(["pheno", "--pheno", tmp_path / "ds000001" / "a.tsv"])
+        with pytest.raises(RuntimeError, match="bagel bids failed"):
+            runner.run(["bids", "fail"])
+
+    assert calls[0][:2] == ["docker", "run"]
+    assert f"{tmp_path}:/data" in calls[0]
+    assert calls[1] == [
+        "docker",
+        "exec",
+        "container-id",
+        "bagel",
+        "pheno",
+        "--pheno",
+        "/data/ds000001/a.tsv",
+    ]
+    assert calls[-1][:2] == ["docker", "stop"]
+
+
+@pytest.mark.parametrize(
+    "description",
+    [
+        {"Name": "a dataset", "BIDSVersion": "1.8.0"},
+        {"Name": "", "BIDSVersion": "1.8.0"},
+        {"Name": "a dataset"},
+        {"BIDSVersion": "1.8.0"},
+        "not json",
+        None,
+    ],
+)
+def test_get_dataset_name_same_as_layout(tmp_path, description):
+    if description is not None:
+        (tmp_path / "dataset_description.json").write_text(
+            description
+            if isinstance(description, str)
+            else json.dumps(description)
+        )
+
+    assert get_dataset_name(tmp_path) == get_dataset_name(
+        tmp_path, use_layout=True
+    )
+
+
+def test_extract_names_batch(datasets):
+    result = CliRunner().invoke(
+        cli(extract_name_main),
+        [x for pth in datasets for x in ["--ds", str(pth)]],
+    )
+
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [
+        "dataset\tname",
+        "ds000001\tname of ds000001",
+        "ds000002\tname of ds000002",
+    ]
+
+
+def test_extract_names_batch_not_quoted(datasets):
+    (datasets[0] / "dataset_description.json").write_text(
+        json.dumps({"Name": 'the "first"\tdataset\n', "BIDSVersion": "1.8.0"})
+    )
+
+    result = CliRunner().invoke(
+        cli(extract_name_main),
+        [x for pth in datasets for x in ["--ds", str(pth)]],
+    )
+
+    assert result.exit_code == 0
+    assert result.stdout.splitlines()[1] == 'ds000001\tthe "first" dataset'
+
+
+def test_patch_dictionaries(tmp_path, datasets):
+    before = {
+        pth: (pth / "participants.json").stat().st_mtime_ns for pth in datasets
+    }
+
+    result = CliRunner().invoke(
+        cli(add_description_main),
+        [str(datasets[0].parent), "--output", str(tmp_path / "patched")],
+    )
+
+    assert result.exit_code == 0
+    for pth in datasets:
+        patched = tmp_path / "patched" / pth.name / "participants.json"
+        assert json.loads(patched.read_text())["age"]["Description"]
+        assert (pth / "participants.json").stat().st_mtime_ns == before[pth]
+
+
+def test_patch_dictionary_in_place_only_if_changed(datasets):
+    unchanged, changed = [pth / "participants.json" for pth in datasets]
+    mtime = unchanged.stat().st_mtime_ns
+
+    assert not patch_dictionary(unchanged)
+    assert patch_dictionary(changed)
+
+    assert unchanged.stat().st_mtime_ns == mtime
+    assert json.loads(changed.read_text())["age"]["Description"] == DESCRIPTION
+
+
+def test_patch_dictionary_to_stdout(datasets):
+    in_json = datasets[1] / "participants.json"
+
+    result = CliRunner().invoke(
+        cli(add_description_main), [str(in_json), "--output", "-"]
+    )
+
+    assert result.exit_code == 0
+    assert json.loads(result.stdout)["age"]["Description"] == DESCRIPTION
+    assert "Description" not in json.loads(in_json.read_text())["age"]
+
+
+def test_patch_dictionaries_of_a_dataset(tmp_path, datasets):
+    dataset = datasets[1]
+    (dataset / "sub-01").mkdir()
+    (dataset / "sub-01" / "sub-01_bold.json").write_text(
+        json.dumps({"RepetitionTime": 2})
+    )
+    output = tmp_path / "patched"
+
+    result = CliRunner().invoke(
+        cli(add_description_main), [str(dataset), "--output", str(output)]
+    )
+
+    assert result.exit_code == 0, result.output
+    # a single dataset still gets an output directory
+    assert [x.relative_to(output) for x in output.rglob("*.json")] == [
+        Path(dataset.name) / "participants.json"
+    ]
+
+
+def test_patch_dictionary_skips_other_files(datasets):
+    description = datasets[0] / "dataset_description.json"
+    before = description.read_text()
+
+    result = CliRunner().invoke(
+        cli(add_description_main),
+        [str(description), str(datasets[1] / "participants.json")],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert description.read_text() == before
+    assert json.loads((datasets[1] / "participants.json").read_text())["age"][
+        "Description"
+    ]
+    with pytest.raises(ValueError, match="not a data dictionary"):
+        patch_dictionary(description)
@@ -0,0 +1,109 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import typer
+from typer.testing import CliRunner
+
+import benchmark
+from synthetic_corpus import generate_corpus
+
+
+def cli(main):
+    app = typer.Typer()
+    app.command()(main)
+    return app
+
+
+def test_generate_corpus(tmp_path):
+    openneuro = generate_corpus(
+        tmp_path / "a", nb_datasets=3, nb_rows=10, nb_columns=12
+    )
+    other = generate_corpus(
+        tmp_path / "b", nb_datasets=3, nb_rows=10, nb_columns=12
+    )
+
+    assert sorted(x.name for x in openneuro.iterdir()) == [
+        "ds000001",
+        "ds000002",
+        "ds000003",
+    ]
+    for ds in openneuro.iterdir():
+        participants = pd.read_csv(ds / "participants.tsv", sep="\t")
+        assert participants.shape == (10, 13)
+        assert (ds / "dataset_description.json").exists()
+        assert (ds / "participants.tsv").read_text() == (
+            other / ds.name / "participants.tsv"
+        ).read_text()
+
+
+def test_benchmark(tmp_path):
+    output = tmp_path / "results.json"
+
+    result = CliRunner().invoke(
+        cli(benchmark.main),
+        [
+            "--nb-datasets",
+            "2",
+            "--nb-rows",
+            "5",
+            "--repeats",
+            "1",
+            "--output",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    with open(output) as f:
+        report = json.load(f)
+    assert set(report["results"]) == set(benchmark.BENCHMARKS)
+    assert report["results"]["scan_participants"]["nb_items"] == 2
+
+    result = CliRunner().invoke(
+        cli(benchmark.main),
+        [
+            "--nb-datasets",
+            "2",
+            "--repeats",
+            "1",
+            "--only",
+            "sanity_checks",
+            "--output",
+            str(tmp_path / "other.json"),
+            "--compare",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "speedup" in result.output
+
+
+@pytest.mark.parametrize(
+    "module, lazy_modules",
+    [
+        ("extract_bids_dataset_name", ["bids"]),
+        ("bagel_batch", ["bids", "pandas"]),
+        ("list_openneuro_dependencies", ["datalad.api"]),
+        ("process_annotation_to_dict", ["jsonschema"]),
+    ],
+)
+def test_lazy_imports(module, lazy_modules):
+    code = f"import sys, {module}; print(*sorted(sys.modules))"
+    imported = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent,
+    ).stdout.split()
+
+    for lazy_module in lazy_modules:
+        assert lazy_module not in imported
+
+
+def test_import_time():
+    assert 0 < benchmark.import_time("add_description") < 10
@@ -0,0 +1,78 @@
+import json
+
+import pandas as pd
+import pytest
+
+import instrumentation
+from instrumentation import load_events, stage, summarize, timed
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(instrumentation, "TRACE_FILE", trace_file)
+    instrumentation.reset()
+    yield trace_file
+    instrumentation.close()
+
+
+@timed
+def double(x):
+    return 2 * x
+
+
+def test_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, "TRACE_FILE", None)
+
+    with stage("something", dataset="ds000001") as info:
+        info["rows"] = 3
+    assert double(2) == 4
+
+    assert instrumentation.report() is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stages(trace_file):
+    with stage("scan_dataset", dataset="ds000001") as info:
+        with stage("column", dataset="ds000001", column="age", rows=3):
+            assert double(2) == 4
+        info["rows"] = 3
+
+    events = load_events(trace_file)
+
+    assert list(events["name"]) == ["double", "column", "scan_dataset"]
+    assert (events["ph"] == "X").all()
+    assert events.loc[2, "rows"] == 3
+    assert events.loc[1, "column"] == "age"
+    # stages are nested
+    assert events.loc[2, "dur"] >= events.loc[1, "dur"] >= events.loc[0, "dur"]
+
+
+def test_report(trace_file):
+    for dataset in ["ds000001", "ds000002"]:
+        with stage("scan_dataset", dataset=dataset, rows=10, columns=2):
+            double(1)
+
+    summary = instrumentation.report(top=1)
+
+    assert "1 slowest scan_dataset" in summary
+    with open(trace_file.with_name("trace_chrome.json")) as f:
+        chrome_trace = json.load(f)
+    assert len(chrome_trace["traceEvents"]) == 4
+
+
+def test_summarize():
+    events = pd.DataFrame(
+        {
+            "name": ["column", "column", "scan_dataset"],
+            "dur": [1000, 3000, 5000],
+            "dataset": ["ds000001", "ds000001", "ds000001"],
+            "column": ["height", "weight", None],
+            "rows": [10, 10, 10],
+        }
+    )
+
+    summary = summarize(events, top=1)
+
+    assert "weight" in summary
+    assert "height" not in summary
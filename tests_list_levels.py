@@ -0,0 +1,241 @@
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import scan_participants
+import utils
+from list_participants_tsv_columns import list_dataset_columns
+from list_participants_tsv_levels import sanity_checks, scan_datasets
+from utils import (
+    LEVELS_DTYPES,
+    TableWriter,
+    init_output,
+    load_table,
+    save_table,
+    write_table,
+)
+
+
+@pytest.fixture
+def input_tsv():
+    return Path(__file__).parent / "tests" / "data" / "participants.tsv"
+
+
+@pytest.fixture
+def superdataset(tmp_path, input_tsv):
+    for name in ["ds000001", "ds000002", "ds000003"]:
+        (tmp_path / name).mkdir()
+        shutil.copy(input_tsv, tmp_path / name / "participants.tsv")
+    with open(tmp_path / "ds000002" / "participants.json", "w") as f:
+        json.dump(
+            {"sex": {"Description": "sex", "Levels": {"F": "female"}}}, f
+        )
+    return tmp_path
+
+
+@pytest.fixture
+def datasets():
+    datasets = pd.DataFrame(
+        {
+            "name": ["ds000001", "ds000002", "ds000003", "ds000004"],
+            "has_participant_tsv": [True, True, True, False],
+            "has_participant_json": [False, True, False, False],
+            "has_mri": [True, True, True, True],
+        }
+    )
+    return [dataset for _, dataset in datasets.iterrows()]
+
+
+def test_scan_datasets_parallel_same_as_serial(superdataset, datasets):
+    serial = list(scan_datasets(datasets, superdataset, n_jobs=1))
+    parallel = list(scan_datasets(datasets, superdataset, n_jobs=2))
+
+    assert parallel == serial
+    assert [output["dataset"][0] for output in parallel[:3]] == [
+        "ds000001",
+        "ds000002",
+        "ds000003",
+    ]
+    assert parallel[3]["dataset"] == []
+
+
+def test_scan_datasets_bounds_pending_datasets(
+    superdataset, datasets, monkeypatch
+):
+    monkeypatch.setattr(scan_participants, "PENDING_PER_JOB", 1)
+    submitted = []
+
+    def iter_datasets():
+        for dataset in datasets * 3:
+            submitted.append(dataset["name"])
+            yield dataset
+
+    outputs = scan_datasets(iter_datasets(), superdataset, n_jobs=2)
+    first = next(outputs)
+
+    # 2 datasets pending, the third one waits for the first one
+    assert len(submitted) == 3
+    assert [first, *outputs] == list(scan_datasets(datasets * 3, superdataset))
+
+
+def test_scan_datasets_reuses_cache(tmp_path, superdataset, datasets):
+    cache = tmp_path / "cache"
+    first = list(scan_datasets(datasets, superdataset, cache=cache))
+    assert sorted(pth.name for pth in cache.glob("*.json")) == [
+        "ds000001.json",
+        "ds000002.json",
+        "ds000003.json",
+    ]
+
+    with open(superdataset / "ds000003" / "participants.tsv", "w") as f:
+        f.write("participant_id\tsex\nsub-01\tM\n")
+    second = list(scan_datasets(datasets, superdataset, cache=cache))
+
+    assert second[:2] == first[:2]
+    assert second[2]["nb_rows"][0] == 1
+    assert second[2] != first[2]
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "output_dir", lambda: tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def batches(superdataset, datasets):
+    batches = list(scan_datasets(datasets, superdataset))
+    batches[0]["description"][0] = 'tab\t, "quotes"\nand new line'
+    batches[0]["description"][1] = None
+    batches[0]["description"][2] = {"Description": "a dict"}
+    return batches
+
+
+def to_table(batches: list[dict[str, list]]) -> pd.DataFrame:
+    output = init_output(include_levels=True)
+    for batch in batches:
+        for key in output:
+            output[key].extend(batch[key])
+    return pd.DataFrame.from_dict(output)
+
+
+@pytest.mark.parametrize("output_format", ["tsv", "parquet"])
+def test_table_writer_same_as_save_table(
+    output_dir, batches, monkeypatch, output_format
+):
+    monkeypatch.setattr(utils, "OUTPUT_FORMAT", output_format)
+    columns = list(init_output(include_levels=True))
+
+    with TableWriter("streamed", columns, LEVELS_DTYPES) as writer:
+        for batch in batches:
+            writer.write(batch)
+    save_table(to_table(batches), "saved", LEVELS_DTYPES)
+
+    assert writer.path == output_dir / f"streamed.{output_format}"
+    assert (output_dir / "streamed.tsv").read_bytes() == (
+        output_dir / "saved.tsv"
+    ).read_bytes()
+    pd.testing.assert_frame_equal(
+        load_table("streamed", LEVELS_DTYPES),
+        load_table("saved", LEVELS_DTYPES),
+    )
+
+
+def test_table_writer_keeps_rows_written_before_error(output_dir, batches):
+    columns = list(init_output(include_levels=True))
+
+    with pytest.raises(RuntimeError):
+        with TableWriter("streamed", columns) as writer:
+            writer.write(batches[0])
+            raise RuntimeError
+
+    assert len(pd.read_csv(writer.tsv, sep="\t")) == len(batches[0]["dataset"])
+
+
+@pytest.mark.parametrize("suffix", [".tsv", ".parquet"])
+def test_sanity_checks(tmp_path, suffix):
+    output = to_table(
+        [
+            {
+                "dataset": ["ds1", "ds1", "ds1", "ds1", "ds1", "ds2", "ds2"],
+                "nb_rows": [2] * 7,
+                "column": ["participant_id", "age", "sex", "sex", "sex"]
+                + ["age", "age"],
+                "value": ["n/a", "n/a", "n/a", "M", "M", "n/a", "n/a"],
+                "nb_occurrences": ["n/a", "n/a", "n/a", 1, 1, "n/a", "n/a"],
+                "type": ["n/a"] * 7,
+                "nb_levels": [2] * 7,
+                "is_row": [True, True, True, False, False, True, True],
+                "description": ["n/a"] * 7,
+                "controlled_term": ["nb:ParticipantID", "nb:Age", "nb:Age"]
+                + ["n/a", "n/a", "n/a", "n/a"],
+                "units": ["n/a"] * 7,
+                "term_url": ["n/a"] * 7,
+            }
+        ]
+    )
+    # "n/a" placeholders are missing values in both formats
+    write_table(output, tmp_path / f"levels{suffix}", LEVELS_DTYPES)
+
+    report = sanity_checks(tmp_path / f"levels{suffix}")
+
+    assert report.to_dict("records") == [
+        {
+            "dataset": "ds2",
+            "column": "n/a",
+            "check": "no_participant_id",
+            "details": "no column",
+        },
+        {
+            "dataset": "ds1",
+            "column": "age, sex",
+            "check": "duplicated_controlled_term",
+            "details": "nb:Age used 2 times",
+        },
+        {
+            "dataset": "ds2",
+            "column": "age",
+            "check": "duplicated_column",
+            "details": "described 2 times",
+        },
+        {
+            "dataset": "ds1",
+            "column": "sex",
+            "check": "duplicated_level",
+            "details": "level 'M' listed 2 times",
+        },
+    ]
+
+
+def test_level_occurrences(superdataset, datasets):
+    output = to_table(scan_datasets(datasets[:2], superdataset))
+    levels = output[~output.is_row.astype(bool)]
+
+    data_levels = levels[levels.dataset == "ds000001"]
+    assert not data_levels.empty
+    assert (
+        data_levels.groupby("column").nb_occurrences.sum()
+        == data_levels.nb_rows.iloc[0]
+    ).all()
+
+    defined = levels[(levels.dataset == "ds000002") & (levels.column == "sex")]
+    assert defined.set_index("value").nb_occurrences.to_dict()["F"] > 0
+
+
+def test_scan_columns_and_levels_in_one_pass(superdataset, datasets):
+    outputs = list(scan_participants.scan_datasets(datasets, superdataset))
+
+    for dataset_output, dataset in zip(outputs, datasets):
+        columns = pd.DataFrame.from_dict(dataset_output["columns"])
+        levels = pd.DataFrame.from_dict(dataset_output["levels"])
+        assert list(columns) == list(init_output())
+
+        column_rows = levels[levels.is_row == True][columns.columns]
+        for key in ["dataset", "nb_rows", "column", "type", "nb_levels"]:
+            assert column_rows[key].tolist() == columns[key].tolist()
+        assert dataset_output["columns"] == list_dataset_columns(
+            dataset, superdataset
+        )
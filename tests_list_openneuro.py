@@ -0,0 +1,125 @@
+import pandas as pd
+import pytest
+
+from list_openneuro_dependencies import (
+    get_nb_subjects,
+    has_mri,
+    has_participant_tsv,
+    index_dataset,
+    init_dataset,
+    list_openneuro,
+    list_participants_tsv_columns,
+)
+
+
+@pytest.fixture
+def bids_dataset(tmp_path):
+    for folder in [
+        "sub-01/anat",
+        "sub-02/ses-01/func",
+        "sub-02/ses-02/beh",
+        "subject_notes",
+        "derivatives/fmriprep",
+        "derivatives/mriqc-23.0",
+        "phenotype",
+    ]:
+        (tmp_path / folder).mkdir(parents=True)
+    (tmp_path / "participants.tsv").write_text(
+        "participant_id\tage\nsub-01\t22\nsub-02\t32\n"
+    )
+    return tmp_path
+
+
+def test_index_dataset(bids_dataset):
+    index = index_dataset(bids_dataset, stop_at_mri=False)
+
+    assert sorted(index["subjects"]) == ["sub-01", "sub-02"]
+    assert sorted(index["sessions"]) == ["sub-02/ses-01", "sub-02/ses-02"]
+    assert sorted(index["mri_folders"]) == [
+        "sub-01/anat",
+        "sub-02/ses-01/func",
+    ]
+    assert index["has_mri"]
+    assert sorted(index["derivatives"]) == ["fmriprep", "mriqc-23.0"]
+    assert index["has_participant_tsv"]
+    assert not index["has_participant_json"]
+    assert index["has_phenotype_dir"]
+
+
+def test_index_dataset_stops_at_mri(bids_dataset):
+    index = index_dataset(bids_dataset)
+
+    assert index["has_mri"]
+    assert len(index["mri_folders"]) == 1
+
+
+def test_has_mri_in_session_only(tmp_path):
+    (tmp_path / "sub-01" / "ses-01" / "dwi").mkdir(parents=True)
+    (tmp_path / "sub-02" / "beh").mkdir(parents=True)
+    assert has_mri(tmp_path)
+
+    (tmp_path / "sub-01" / "ses-01" / "dwi").rmdir()
+    assert not has_mri(tmp_path)
+
+
+def test_get_nb_subjects(bids_dataset):
+    assert get_nb_subjects(bids_dataset) == 2
+    assert get_nb_subjects(bids_dataset / "missing") == 0
+
+
+def test_has_participant_tsv(bids_dataset):
+    assert has_participant_tsv(bids_dataset) == (
+        True,
+        False,
+        ["participant_id", "age"],
+    )
+
+
+def test_list_openneuro_threads_same_as_serial(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "list_openneuro_dependencies.install_dataset",
+        lambda *args, **kwargs: None,
+    )
+    for i in range(8):
+        dataset = tmp_path / "openneuro" / f"ds00000{i}"
+        (dataset / f"sub-0{i}" / "anat").mkdir(parents=True)
+        (dataset / "participants.tsv").write_text("participant_id\nsub-01\n")
+
+    serial = list_openneuro(tmp_path, init_dataset(), n_jobs=1)
+    threaded = list_openneuro(tmp_path, init_dataset(), n_jobs=4)
+
+    assert threaded == serial
+    assert threaded["name"] == [f"ds00000{i}" for i in range(8)]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "participant_id\tage\nsub-01\t22\n",
+        "\ufeffparticipant_id\tage\nsub-01\t22\n",
+        'participant_id\t"age, in years"\r\nsub-01\t22\r\n',
+        "participant_id\tage\tage\nsub-01\t22\t23\n",
+        "participant_id\t\tage\nsub-01\t22\t23\n",
+        "\nparticipant_id\tage\nsub-01\t22",
+    ],
+)
+def test_list_participants_tsv_columns_same_as_pandas(tmp_path, content):
+    participant_tsv = tmp_path / "participants.tsv"
+    participant_tsv.write_text(content, encoding="utf-8")
+
+    columns, nb_rows = list_participants_tsv_columns(
+        participant_tsv, count_rows=True
+    )
+
+    df = pd.read_csv(participant_tsv, sep="\t")
+    assert columns == df.columns.tolist()
+    assert nb_rows >= len(df)
+
+
+def test_count_rows(tmp_path):
+    participant_tsv = tmp_path / "participants.tsv"
+    participant_tsv.write_text("participant_id\nsub-01\nsub-02")
+    assert list_participants_tsv_columns(participant_tsv, count_rows=True) == (
+        ["participant_id"],
+        2,
+    )
@@ -0,0 +1,100 @@
+import io
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+from logger import (
+    JsonFormatter,
+    RateLimitFilter,
+    _QueueHandler,
+    get_handler,
+)
+
+
+def make_record(msg, args=(), level=logging.INFO, rate_limited=True):
+    record = logging.LogRecord(
+        "rich", level, __file__, 1, msg, args, exc_info=None
+    )
+    if rate_limited:
+        record.rate_limited = True
+    return record
+
+
+def test_rate_limit():
+    rate_limit = RateLimitFilter(rate_limit=3, rate_period=60)
+
+    kept = [
+        rate_limit.filter(make_record("level '%s'", (i,))) for i in range(10)
+    ]
+
+    assert kept == [True] * 3 + [False] * 7
+    # other templates, warnings and messages not flagged are not limited
+    assert rate_limit.filter(make_record("dataset '%s'", ("ds000001",)))
+    assert all(
+        rate_limit.filter(
+            make_record("dataset '%s'", (i,), rate_limited=False)
+        )
+        for i in range(10)
+    )
+    assert all(
+        rate_limit.filter(
+            make_record("could not parse %s", (i,), logging.WARNING)
+        )
+        for i in range(10)
+    )
+
+
+def test_rate_limit_suppressed_count():
+    rate_limit = RateLimitFilter(rate_limit=1, rate_period=60)
+    for i in range(5):
+        rate_limit.filter(make_record("level '%s'", (i,)))
+    rate_limit.rate_period = 0
+    record = make_record("level '%s'", (5,))
+
+    assert rate_limit.filter(record)
+    assert record.getMessage() == "level '5' (4 similar messages suppressed)"
+
+
+def test_json_formatter():
+    line = JsonFormatter().format(make_record("dataset '%s'", ("ds000001",)))
+
+    entry = json.loads(line)
+    assert entry["level"] == "INFO"
+    assert entry["message"] == "dataset 'ds000001'"
+
+
+@pytest.mark.parametrize(
+    "log_format, formatter",
+    [("plain", logging.Formatter), ("json", JsonFormatter)],
+)
+def test_get_handler(log_format, formatter):
+    handler = get_handler(log_format)
+
+    assert type(handler.formatter) is formatter
+
+
+def test_get_handler_unknown():
+    with pytest.raises(ValueError, match="unknown log format"):
+        get_handler("xml")
+
+
+def test_queue_handler_keeps_exception():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    queue_handler = _QueueHandler(queue.SimpleQueue(), handler)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record("dataset '%s' failed", ("ds000001",))
+        record.exc_info = sys.exc_info()
+
+    queue_handler.handle(record)
+    handler.handle(queue_handler.queue.get())
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "dataset 'ds000001' failed"
+    assert "ValueError: boom" in entry["exception"]
@@ -1,9 +1,15 @@
 import json
+import os
+import subprocess
+import sys
+from pathlib import Path
 
 import pandas as pd
 import pytest
 
-from process_annotation_to_dict import process_dict, get_transform_heuristic, describe_continuous, load_annotations, main
+from process_annotation_to_dict import process_dict, get_transform_heuristic, describe_continuous, load_annotations, main, write_data_dict, list_validation_errors
+from utils import LEVELS_DTYPES, write_table
+from validate_dictionaries import validate_dir
 
 
 @pytest.fixture
@@ -211,4 +217,104 @@ def test_missing_value_is_parsed_correctly(missing_file, tmp_path):
     
     assert "m" in annotations["Levels"]
     assert "nan" not in annotations["Levels"]
-    assert "nan" in annotations["MissingValues"]
\ No newline at end of file
+    assert "nan" in annotations["MissingValues"]
+
+
+def test_load_annotations_from_parquet(missing_file, tmp_path):
+    parquet_file = tmp_path / "missing.parquet"
+    write_table(load_annotations(missing_file), parquet_file, LEVELS_DTYPES)
+
+    result = load_annotations(parquet_file)
+
+    pd.testing.assert_frame_equal(result, load_annotations(missing_file))
+    assert result.is_row.dtype == "boolean"
+    assert result.controlled_term.dtype == "category"
+    assert result.value[1] == "nan"
+
+
+def test_main_from_parquet(missing_file, tmp_path):
+    parquet_file = tmp_path / "missing.parquet"
+    write_table(load_annotations(missing_file), parquet_file, LEVELS_DTYPES)
+    main(missing_file, tmp_path / "from_tsv")
+    main(parquet_file, tmp_path / "from_parquet")
+
+    from_tsv = json.loads((tmp_path / "from_tsv" / "ds000002.json").read_text())
+    from_parquet = json.loads(
+        (tmp_path / "from_parquet" / "ds000002.json").read_text()
+    )
+    assert from_parquet == from_tsv
+
+
+def test_discrete_annotation_levels(discrete_annotation):
+    result = process_dict(pd.DataFrame(discrete_annotation), {})
+
+    assert result["sex"]["Annotations"]["Levels"] == {
+        "F": {"TermURL": "snomed:248152002", "Label": ""},
+        "M": {"TermURL": "snomed:248153007", "Label": ""},
+        "M,": {"TermURL": "snomed:248153007", "Label": ""},
+    }
+    assert "MissingValues" not in result["sex"]["Annotations"]
+
+
+def test_column_described_twice_raises(discrete_annotation):
+    discrete_annotation["is_row"][2] = True
+    with pytest.raises(ValueError):
+        process_dict(pd.DataFrame(discrete_annotation), {})
+
+
+def test_main_parallel_same_as_serial(missing_file, tmp_path):
+    main(missing_file, tmp_path / "serial")
+    invalid = main(missing_file, tmp_path / "parallel", n_jobs=2)
+
+    assert invalid == []
+    assert (tmp_path / "parallel" / "ds000002.json").read_text() == (
+        tmp_path / "serial" / "ds000002.json"
+    ).read_text()
+
+
+def test_main_does_not_rewrite_dictionaries(missing_file, tmp_path):
+    """Each run is a new interpreter, with another order of the sets of strings."""
+    out_path = tmp_path / "ds000002.json"
+    code = f"from pathlib import Path; from process_annotation_to_dict import main; main(Path({str(missing_file)!r}), Path({str(tmp_path)!r}), 1)"
+    for seed in range(5):
+        subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            capture_output=True,
+            cwd=Path(__file__).parent,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        )
+        if seed == 0:
+            text, mtime = out_path.read_text(), out_path.stat().st_mtime_ns
+
+        assert out_path.read_text() == text
+        assert out_path.stat().st_mtime_ns == mtime
+
+
+def test_write_data_dict_skips_unchanged(tmp_path, user_dict):
+    assert write_data_dict(user_dict, tmp_path, "ds000001")
+    assert not write_data_dict(user_dict, tmp_path, "ds000001")
+    assert list(tmp_path.iterdir()) == [tmp_path / "ds000001.json"]
+
+
+def test_list_validation_errors(user_dict):
+    user_dict["age"]["Annotations"] = {"IsAbout": {"TermURL": "nb:Age"}}
+    errors = list_validation_errors(user_dict)
+
+    assert errors
+    assert all(error["path"].startswith("$.age") for error in errors)
+    assert list_validation_errors({"sex": {"Description": "sex"}}) == []
+
+
+def test_validate_dir(tmp_path, user_dict):
+    write_data_dict({"sex": {"Description": "sex"}}, tmp_path, "ds000001")
+    user_dict["age"]["Annotations"] = {}
+    write_data_dict(user_dict, tmp_path, "ds000002")
+    (tmp_path / "ds000003.json").write_text("{")
+
+    report = validate_dir(tmp_path, n_jobs=2)
+
+    assert report["nb_files"] == 3
+    assert report["nb_invalid"] == 2
+    assert [x["valid"] for x in report["files"]] == [True, False, False]
+    assert report == validate_dir(tmp_path)
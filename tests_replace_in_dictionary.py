@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from src.replace_in_dictionary import (
+    parse_dictionaries,
+    process_dictionary,
+    remap_terms,
+)
+
+MAP = {"cogatlas:old_1": "snomed:new_1", "cogatlas:old_2": "snomed:new_2"}
+
+
+def tool(term):
+    return {"Annotations": {"IsPartOf": {"TermURL": term}}}
+
+
+@pytest.fixture
+def map_file(tmp_path):
+    map_file = tmp_path / "vocab_map.json"
+    map_file.write_text(json.dumps(MAP))
+    return map_file
+
+
+@pytest.fixture
+def work_dir(tmp_path):
+    work_dir = tmp_path / "annotations"
+    work_dir.mkdir()
+    dictionaries = {
+        # one term remapped, one term dropped
+        "ds000001.json": {
+            "a": tool("cogatlas:old_1"),
+            "b": tool("cogatlas:unknown"),
+            "age": {"Description": "age"},
+        },
+        # already remapped, saved with another indentation
+        "ds000002.json": {"a": tool("snomed:new_2")},
+    }
+    for name, dictionary in dictionaries.items():
+        (work_dir / name).write_text(json.dumps(dictionary, indent=2))
+    return work_dir
+
+
+def test_remap_terms():
+    dictionary = {
+        "a": tool("cogatlas:old_1"),
+        "b": tool("snomed:new_2"),
+        "c": tool("cogatlas:unknown"),
+    }
+
+    updated, nb_remapped, nb_dropped = remap_terms(dictionary, MAP)
+
+    assert (nb_remapped, nb_dropped) == (1, 1)
+    assert updated == {
+        "a": tool("snomed:new_1"),
+        "b": tool("snomed:new_2"),
+        "c": {},
+    }
+    # remapping twice changes nothing
+    assert remap_terms(updated, MAP) == (updated, 0, 0)
+
+
+def test_process_dictionary(work_dir):
+    unchanged = work_dir / "ds000002.json"
+    text = unchanged.read_text()
+
+    reports = [
+        process_dictionary(work_dir / name, MAP)
+        for name in ["ds000001.json", "ds000002.json"]
+    ]
+
+    assert reports == [
+        {
+            "file": "ds000001.json",
+            "remapped": 1,
+            "dropped": 1,
+            "changed": True,
+        },
+        {
+            "file": "ds000002.json",
+            "remapped": 0,
+            "dropped": 0,
+            "changed": False,
+        },
+    ]
+    # a different formatting of the same content is not rewritten
+    assert unchanged.read_text() == text
+    assert json.loads((work_dir / "ds000001.json").read_text()) == {
+        "a": tool("snomed:new_1"),
+        "b": {},
+        "age": {"Description": "age"},
+    }
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_parse_dictionaries_idempotent(work_dir, map_file, n_jobs):
+    reports = parse_dictionaries(work_dir, map_file, n_jobs)
+    contents = {pth: pth.read_text() for pth in work_dir.glob("*.json")}
+
+    assert [x["changed"] for x in reports] == [True, False]
+
+    reports = parse_dictionaries(work_dir, map_file, n_jobs)
+
+    assert not any(x["changed"] for x in reports)
+    assert not any(x["remapped"] or x["dropped"] for x in reports)
+    assert {
+        pth: pth.read_text() for pth in work_dir.glob("*.json")
+    } == contents
@@ -1,15 +1,20 @@
+import json
+import warnings
 from pathlib import Path
 
+import pandas as pd
 import pytest
 
 from heuristics import (
+    RuleRegistry,
     get_column_type,
     is_euro_format,
     is_participant_id,
     is_sex,
     is_yes_no,
+    match_controlled_term,
 )
-from utils import read_csv_autodetect_date
+from utils import dt_inplace, read_csv_autodetect_date
 
 
 @pytest.fixture
@@ -22,6 +27,58 @@ def test_read_csv(input_tsv):
     assert df.acq_date.dtype == "datetime64[ns]"
 
 
+@pytest.mark.parametrize("reverse", [False, True])
+def test_read_csv_date_order_independent(tmp_path, reverse):
+    """Date detection of a file does not depend on the files read before."""
+    day_first = tmp_path / "day_first.tsv"
+    day_first.write_text("dob\n31/01/2020\n")
+    month_first = tmp_path / "month_first.tsv"
+    # the first dates can also be read day first
+    month_first.write_text(
+        "dob\n"
+        + "".join(
+            f"{month:02d}/{day:02d}/2020\n"
+            for month in range(1, 4)
+            for day in range(1, 10)
+        )
+        + "01/13/2020\n"
+    )
+    ambiguous = tmp_path / "ambiguous.tsv"
+    ambiguous.write_text("dob\n01/02/2020\n03/04/2020\n")
+
+    files = [day_first, month_first, ambiguous]
+    if reverse:
+        files = files[::-1]
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        dfs = {
+            pth.stem: read_csv_autodetect_date(pth, sep="\t") for pth in files
+        }
+
+    assert dfs["day_first"].dob.dtype == "datetime64[ns]"
+    assert dfs["month_first"].dob.dtype == "datetime64[ns]"
+    assert dfs["ambiguous"].dob.tolist() == [
+        pd.Timestamp("2020-01-02"),
+        pd.Timestamp("2020-03-04"),
+    ]
+    # no warning of pandas about the guessed formats
+    assert caught == []
+
+
+def test_dt_inplace_leaves_non_dates():
+    df = pd.DataFrame(
+        {
+            "numbers": ["22", "3.5", "4"],
+            "words": ["M", "F", "M"],
+            "dates": ["01/31/2020", "02/01/2020", None],
+        }
+    )
+    df = dt_inplace(df)
+    assert df.numbers.dtype == "object"
+    assert df.words.dtype == "object"
+    assert df.dates.dtype == "datetime64[ns]"
+
+
 def test_is_yes_no(input_tsv):
     df = read_csv_autodetect_date(input_tsv, sep="\t")
 
@@ -54,6 +111,22 @@ def test_get_column_type(input_tsv):
     assert get_column_type(df["is_int"]) == "int"
 
 
+@pytest.mark.parametrize(
+    "levels,expected",
+    [
+        (["12Y", " 3Y", None], "ageY"),
+        (["", "  "], "int"),
+        ([1, 0, 1], "yes_no"),
+        ([1, 2], "int"),
+        ([1.5, 2.0], "float"),
+        (["a", 1], "object"),
+        ([None], "yes_no"),
+    ],
+)
+def test_get_column_type_object(levels, expected):
+    assert get_column_type(pd.Series(levels, dtype=object)) == expected
+
+
 def test_is_sex():
     assert is_sex("sex")
 
@@ -62,3 +135,43 @@ def test_is_participant_id(input_tsv):
     df = read_csv_autodetect_date(input_tsv, sep="\t")
     assert is_participant_id(df, "participant_id")
     assert not is_participant_id(df, "acq_date")
+
+
+@pytest.mark.parametrize(
+    "column, expected",
+    [
+        ("sex", "nb:Sex"),
+        (" Gender ", "nb:Sex"),
+        ("AgeAtFirstScanYears", "nb:Age"),
+        ("age at baseline", "nb:Age"),
+        ("participant", "nb:ParticipantID"),
+        ("part", None),
+        ("age_ses-t1", None),
+    ],
+)
+def test_match_controlled_term(column, expected):
+    assert match_controlled_term(column) == expected
+
+
+def test_rule_registry(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "nb:Age": {"names": ["AGE"], "patterns": ["age_ses-t[0-9]+"]},
+                "nb:Sex": ["sexe"],
+            }
+        )
+    )
+    rules = RuleRegistry()
+    rules.register(rules_file)
+
+    assert rules.match("age") == "nb:Age"
+    assert rules.match("Age_ses-T2 ") == "nb:Age"
+    assert rules.match("age_ses-t2_t1w") is None
+    assert rules.match("sexe") == "nb:Sex"
+
+    with pytest.raises(ValueError, match="already a synonym"):
+        rules.add({"nb:Sex": ["age"]})
+    with pytest.raises(ValueError, match="must be a list"):
+        rules.add({"nb:Diagnosis": ("diagnosis")})
@@ -0,0 +1,24 @@
+import json
+
+from src.vocab_map import make_map
+
+
+def test_make_map(tmp_path, capsys):
+    dictionary = {
+        label: {"Annotations": {"IsPartOf": {"TermURL": f"snomed:{label}"}}}
+        for label in ["mapped", "not_in_table", "empty_cell"]
+    }
+    dictionary["age"] = {"Description": "age"}
+    input_file = tmp_path / "dictionary.json"
+    input_file.write_text(json.dumps(dictionary))
+    table_file = tmp_path / "assessments.tsv"
+    table_file.write_text("mapped\tempty_cell\ncogatlas:trm_1\t\n")
+    output_file = tmp_path / "vocab_map.json"
+
+    unmapped = make_map(input_file, table_file, output_file)
+
+    assert unmapped == ["not_in_table", "empty_cell"]
+    assert json.loads(output_file.read_text()) == {
+        "cogatlas:trm_1": "snomed:mapped"
+    }
+    assert "2 labels are not in" in capsys.readouterr().out
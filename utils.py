@@ -1,37 +1,302 @@
 import contextlib
+import csv
 import json
+import re
 import warnings
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+from pandas.tseries.api import guess_datetime_format
 
 from heuristics import get_column_type
+from instrumentation import timed
+
+# format used to pass tables between the steps of the pipeline:
+# "tsv" or "parquet" (requires pyarrow)
+#
+# TSV files are always written as they are used by the annotation tool.
+OUTPUT_FORMAT = "tsv"
+
+# explicit dtypes of the tables listing the levels of the datasets
+# (bulk_annotation_levels, annotated_levels)
+LEVELS_DTYPES = {
+    "dataset": "category",
+    "column": "category",
+    "controlled_term": "category",
+    "is_row": "boolean",
+}
 
 
 def output_dir() -> Path:
     return Path(__file__).parent / "outputs"
 
 
+def set_dtypes(df: pd.DataFrame, dtypes: dict[str, str]) -> pd.DataFrame:
+    """Cast the columns of a table to the dtypes passed.
+
+    Booleans stored as strings (for example "TRUE" or "False") are parsed.
+    """
+    df = df.copy()
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype == "boolean" and df[column].dtype == "object":
+            df[column] = (
+                df[column]
+                .astype(str)
+                .str.lower()
+                .map({"true": True, "false": False})
+            )
+        df[column] = df[column].astype(dtype)
+    return df
+
+
+def write_table(
+    df: pd.DataFrame, path: Path, dtypes: dict[str, str] | None = None
+) -> None:
+    """Write a table to TSV or to Parquet depending on the file extension.
+
+    When writing to Parquet,
+    the columns are cast to ``dtypes``
+    and the values of the remaining 'object' columns
+    are converted to strings like in a TSV.
+    """
+    if path.suffix != ".parquet":
+        df.to_csv(path, index=False, sep="\t")
+        return
+
+    to_parquet_dtypes(df, dtypes).to_parquet(path, index=False)
+
+
+def to_parquet_dtypes(
+    df: pd.DataFrame, dtypes: dict[str, str] | None = None
+) -> pd.DataFrame:
+    """Cast the columns of a table to ``dtypes`` \
+    and the values of the remaining 'object' columns to strings."""
+    df = set_dtypes(df, dtypes or {})
+    for column in df.columns[df.dtypes == "object"]:
+        df[column] = df[column].map(str, na_action="ignore")
+    return df
+
+
+def read_table(
+    path: Path, dtypes: dict[str, str] | None = None, **kwargs
+) -> pd.DataFrame:
+    """Read a table written by write_table.
+
+    Extra keyword arguments are passed to pd.read_csv for TSV files.
+    Parquet files are loaded as their TSV version would be:
+    the values read as missing by pd.read_csv ("n/a"...) are replaced by NA,
+    unless ``keep_default_na=False`` is passed.
+    """
+    if path.suffix == ".parquet":
+        df = pd.read_parquet(path)
+        if kwargs.get("keep_default_na", True):
+            for column in df.select_dtypes(["object", "category"]):
+                df[column] = df[column].mask(df[column].isin(STR_NA_VALUES))
+                if df[column].dtype == "category":
+                    df[column] = df[column].cat.remove_unused_categories()
+    else:
+        df = pd.read_csv(path, sep="\t", **kwargs)
+    return set_dtypes(df, dtypes or {})
+
+
+def save_table(
+    df: pd.DataFrame, name: str, dtypes: dict[str, str] | None = None
+) -> Path:
+    """Save a table in the output directory.
+
+    Returns the path of the table in OUTPUT_FORMAT.
+    """
+    tsv = output_dir() / f"{name}.tsv"
+    write_table(df, tsv)
+    if OUTPUT_FORMAT == "tsv":
+        return tsv
+    path = output_dir() / f"{name}.{OUTPUT_FORMAT}"
+    write_table(df, path, dtypes)
+    return path
+
+
+def load_table(
+    name: str, dtypes: dict[str, str] | None = None
+) -> pd.DataFrame:
+    """Load a table from the output directory in OUTPUT_FORMAT."""
+    return read_table(output_dir() / f"{name}.{OUTPUT_FORMAT}", dtypes)
+
+
+class TableWriter:
+    """Save a table in the output directory one batch of rows at a time.
+
+    Each batch is appended to the TSV file as soon as it is written
+    (and to the Parquet file as a row group if OUTPUT_FORMAT is parquet),
+    so the whole table is never held in memory
+    and the rows written before a crash are kept in the TSV file.
+
+    Writes the same files as save_table.
+
+    Usage::
+
+        with TableWriter("bulk_annotation_levels", columns) as writer:
+            for rows in batches:
+                writer.write(rows)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        columns: list[str],
+        dtypes: dict[str, str] | None = None,
+    ):
+        self.columns = columns
+        # categories of each row group would not match:
+        # they are restored by load_table
+        self.dtypes = {
+            column: dtype
+            for column, dtype in (dtypes or {}).items()
+            if dtype != "category"
+        }
+        self.tsv = output_dir() / f"{name}.tsv"
+        self.path = output_dir() / f"{name}.{OUTPUT_FORMAT}"
+        self._tsv_file = None
+        self._tsv_writer = None
+        self._parquet_writer = None
+
+    def __enter__(self) -> "TableWriter":
+        """Open the TSV file and write its header."""
+        self._tsv_file = open(self.tsv, "w", newline="")
+        # same dialect as pd.DataFrame.to_csv(sep="\t")
+        self._tsv_writer = csv.writer(
+            self._tsv_file, delimiter="\t", lineterminator="\n"
+        )
+        self._tsv_writer.writerow(self.columns)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Close the files (an empty table is written if no row was)."""
+        self._tsv_file.close()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        elif self.path != self.tsv:
+            write_table(pd.DataFrame(columns=self.columns), self.path)
+
+    def write(self, rows: dict[str, list]) -> None:
+        """Append a batch of rows (in the format of init_output) to the table."""
+        if not rows[self.columns[0]]:
+            return
+        self._tsv_writer.writerows(
+            zip(*([_tsv_value(x) for x in rows[c]] for c in self.columns))
+        )
+        self._tsv_file.flush()
+        if self.path != self.tsv:
+            self._write_row_group(rows)
+
+    def _write_row_group(self, rows: dict[str, list]) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        df = pd.DataFrame.from_dict({c: rows[c] for c in self.columns})
+        df = to_parquet_dtypes(df, self.dtypes)
+
+        if self._parquet_writer is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            # columns with only missing values in the first batch
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(pa.string()))
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+
+        self._parquet_writer.write_table(
+            pa.Table.from_pandas(
+                df, schema=self._parquet_writer.schema, preserve_index=False
+            )
+        )
+
+
+def _tsv_value(value):
+    """Format missing values like pd.DataFrame.to_csv."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    return value
+
+
+# maximum number of unique values of a column
+# used to detect if that column contains dates
+DATE_SAMPLE_SIZE = 20
+
+
 def dt_inplace(df: pd.DataFrame) -> pd.DataFrame:
     """Automatically detect and convert (in place!) each dataframe column \
     of datatype 'object' to a datetime just \
     when ALL of its non-NaN values can be successfully parsed by pd.to_datetime().
 
+    To avoid parsing full columns that are not dates,
+    a sample of the unique values of each column is first checked:
+    values must contain digits and be parsed with the same format.
+    This format is then used to convert the whole column.
+    The format is inferred from each dataframe on its own
+    so that the result does not depend on the files read before.
+
     Also returns a ref. to df for convenient use in an expression.
 
     from :
     https://towardsdatascience.com/auto-detect-and-set-the-date-datetime-datatypes-when-reading-csv-into-pandas-261746095361
     """
-    from pandas.errors import ParserError
-
     for c in df.columns[df.dtypes == "object"]:  # don't convert num
-        with contextlib.suppress(ParserError, ValueError, TypeError):
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                df[c] = pd.to_datetime(df[c])
+        sample = df[c].dropna().unique()[:DATE_SAMPLE_SIZE]
+        if not all(
+            isinstance(x, str) and re.search("[0-9]", x) for x in sample
+        ):
+            continue
+
+        date_format = infer_date_format(sample)
+        if date_format is None:
+            continue
+
+        converted = to_datetime(df[c], date_format or None)
+        if converted is not None:
+            df[c] = converted
     return df
 
 
+def infer_date_format(sample: np.ndarray) -> str | None:
+    """Return the datetime format that parses all the values of the sample.
+
+    The format is guessed from the first value, like pd.to_datetime() does.
+
+    Returns an empty string if the values can only be parsed
+    without an explicit format and None if they are not dates.
+    """
+    if len(sample) == 0:
+        return ""
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        date_format = guess_datetime_format(sample[0])
+    if date_format and to_datetime(sample, date_format) is not None:
+        return date_format
+
+    if to_datetime(sample) is not None:
+        return ""
+    return None
+
+
+def to_datetime(
+    values: pd.Series | np.ndarray, date_format: str | None = None
+) -> pd.Series | pd.DatetimeIndex | None:
+    """Return values converted with pd.to_datetime() \
+    or None if they cannot be parsed."""
+    from pandas.errors import ParserError
+
+    with contextlib.suppress(ParserError, ValueError, TypeError):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return pd.to_datetime(values, format=date_format)
+    return None
+
+
+@timed
 def read_csv_autodetect_date(*args, **kwargs) -> pd.DataFrame:
     """Drop-in replacement for Pandas pd.read_csv.
 
@@ -58,6 +323,7 @@ def new_row_template(
             "type": "n/a",
             "nb_levels": 0,
             "value": "n/a",
+            "nb_occurrences": "n/a",
             "is_row": "n/a",
             "description": "n/a",
             "controlled_term": "n/a",
@@ -85,6 +351,7 @@ def init_output(include_levels: bool = False) -> dict[str, list]:
             "nb_rows": [],
             "column": [],
             "value": [],
+            "nb_occurrences": [],
             "type": [],
             "nb_levels": [],
             "is_row": [],
@@ -112,6 +379,7 @@ def exclude_datasets(dataset: pd.DataFrame):
     return not dataset["has_mri"] or not dataset["has_participant_tsv"]
 
 
+@timed
 def get_participants_dict(dataset: pd.DataFrame, src_pth: Path):
     """Load participants.json if it exists."""
     participants_dict = {}
@@ -146,12 +414,26 @@ def get_column_term_url(participants_dict, column):
     return "n/a"
 
 
+def count_levels(col: pd.Series) -> pd.Series:
+    """Return the number of occurrences of each level of a column, \
+    missing values included."""
+    return col.value_counts(dropna=False, sort=False)
+
+
 def update_row_with_column_info(
     this_row: dict,
     column: str,
     participants: pd.DataFrame,
     participants_dict: dict,
+    level_counts: pd.Series | None = None,
 ):
+    """Describe a column of a participants.tsv.
+
+    ``level_counts`` are the counts of the levels of the column
+    as returned by count_levels, they are computed if not passed.
+    """
+    if level_counts is None:
+        level_counts = count_levels(participants[column])
     this_row["column"] = column.strip()
     this_row["is_row"] = True
     if column == "participant_id":
@@ -160,5 +442,5 @@ def update_row_with_column_info(
     this_row["unit"] = get_column_unit(participants_dict, column)
     this_row["term_url"] = get_column_term_url(participants_dict, column)
     this_row["type"] = get_column_type(participants[column])
-    this_row["nb_levels"] = len(participants[column].unique())
+    this_row["nb_levels"] = len(level_counts)
     return this_row
@@ -0,0 +1,83 @@
+"""Validate all the Neurobagel data dictionaries in a directory.
+
+For example the annotated data dictionaries of the openneuro-annotations submodule.
+
+Prints (or saves) a JSON report listing, for each data dictionary,
+every validation error with its JSON path.
+Exits with a non-zero code if any data dictionary is not valid.
+"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import typer
+
+from process_annotation_to_dict import list_validation_errors
+
+
+def validate_file(dictionary_file: Path) -> dict:
+    """Return the validation report of a single data dictionary."""
+    try:
+        with open(dictionary_file) as f:
+            data_dict = json.load(f)
+    except json.JSONDecodeError as exc:
+        errors = [{"path": "$", "message": f"invalid JSON: {exc}"}]
+    else:
+        errors = list_validation_errors(data_dict)
+    return {
+        "file": dictionary_file.name,
+        "valid": not errors,
+        "errors": errors,
+    }
+
+
+def validate_dir(directory: Path, n_jobs: int = 1) -> dict:
+    """Return the validation report of all the data dictionaries \
+    in a directory."""
+    dictionary_files = sorted(directory.glob("*.json"))
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            files = list(
+                executor.map(validate_file, dictionary_files, chunksize=16)
+            )
+    else:
+        files = [validate_file(x) for x in dictionary_files]
+
+    return {
+        "directory": str(directory),
+        "nb_files": len(files),
+        "nb_invalid": sum(not x["valid"] for x in files),
+        "files": files,
+    }
+
+
+def main(
+    directory: Path = typer.Argument(
+        ...,
+        help="Directory containing the data dictionaries to validate",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    output: Path = typer.Option(
+        None, help="Save the JSON report to this file instead of printing it"
+    ),
+    n_jobs: int = typer.Option(1, help="Number of worker processes"),
+):
+    """Validate all the Neurobagel data dictionaries in a directory."""
+    report = validate_dir(directory, n_jobs=n_jobs)
+
+    if output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if report["nb_invalid"]:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)